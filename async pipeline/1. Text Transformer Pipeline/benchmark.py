@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+
+"""
+Measure throughput and latency of the text pipeline across batch sizes.
+
+    python benchmark.py [--items 200000] [--batch-sizes 1 10 100 1000]
+
+Throughput: runs the stages of file.py over many small items, output to
+/dev/null, one by one, then in batches.
+
+Latency: feeds items at a steady rate, below capacity, and measures how
+long each one takes from the source to the sink. Each batching stage waits
+at most its timeout for a batch to fill, so latency stays near the sum of
+the timeouts whatever the batch size. That's a typical value, not a bound:
+event loop delays come on top.
+
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import time
+
+import file
+from pipeline import Pipeline
+from streams import BlockSink
+
+WORDS = [b"hello", b"world", b"this", b"is", b"an", b"async", b"pipeline"]
+
+
+async def run(items, batch_size, batch_timeout):
+    sink = BlockSink(os.devnull)
+    source = (WORDS[i % len(WORDS)] for i in range(items))
+    try:
+        await file.build(batch_size, batch_timeout, sink).run(source)
+    finally:
+        await sink.close()
+
+
+def throughput(items, batch_size, batch_timeout):
+    start = time.perf_counter()
+    asyncio.run(run(items, batch_size, batch_timeout))
+    return items / (time.perf_counter() - start)
+
+
+async def paced(rate, duration):
+    # Timestamped items at a steady rate
+    interval, start = 1 / rate, time.perf_counter()
+    for i in range(int(rate * duration)):
+        delay = start + i * interval - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        yield time.perf_counter(), WORDS[i % len(WORDS)]
+
+
+def latency(rate, duration, batch_size, batch_timeout):
+    latencies = []
+
+    def upper(batch):
+        return [(sent, word.upper()) for sent, word in batch]
+
+    def record(batch):
+        now = time.perf_counter()
+        latencies.extend(now - sent for sent, _ in batch)
+
+    pipeline = Pipeline()
+    if batch_size > 1:
+        pipeline.add(upper, batch_size=batch_size, batch_timeout=batch_timeout)
+        pipeline.add(record, batch_size=batch_size, batch_timeout=batch_timeout)
+    else:
+        pipeline.add(lambda item: upper([item])[0])
+        pipeline.add(lambda item: record([item]))
+    asyncio.run(pipeline.run(paced(rate, duration)))
+    latencies.sort()
+    return (
+        statistics.median(latencies) * 1000,
+        latencies[int(len(latencies) * 0.99)] * 1000,
+        latencies[-1] * 1000,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--items", type=int, default=200_000)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 10, 100, 1000])
+    parser.add_argument("--batch-timeout", type=float, default=5, metavar="MS",
+                        help="milliseconds an item may wait for its batch, per stage")
+    parser.add_argument("--rate", type=float, default=5000,
+                        help="items per second for the latency measurement")
+    parser.add_argument("--duration", type=float, default=2)
+    args = parser.parse_args()
+    timeout = args.batch_timeout / 1000
+
+    print(f"{'batch':>6} {'items/s':>11} {'speedup':>8} {'p50 ms':>7} {'p99 ms':>7} {'max ms':>7}")
+    baseline = None
+    for batch_size in args.batch_sizes:
+        rate = throughput(args.items, batch_size, timeout)
+        baseline = baseline or rate
+        p50, p99, worst = latency(args.rate, args.duration, batch_size, timeout)
+        print(
+            f"{batch_size:>6} {rate:>11,.0f} {rate / baseline:>7.1f}x"
+            f" {p50:>7.2f} {p99:>7.2f} {worst:>7.2f}"
+        )
+    # Timeouts wake the waiting worker after a few event loop iterations,
+    # so each stage may overshoot by a millisecond or more when the loop is busy
+    print(f"\nBatching typically adds up to {2 * args.batch_timeout:g} ms per item"
+          f" (2 stages x {args.batch_timeout:g} ms); event loop delays come on top")
+
+
+if __name__ == "__main__":
+    main()
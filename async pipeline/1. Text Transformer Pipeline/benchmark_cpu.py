@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+
+"""
+Measure CPU-bound stages run on the event loop and in a process pool.
+
+    python benchmark_cpu.py [--items 200] [--payloads 64] [--payload-size 4]
+
+First, a CPU-heavy transform on small items: throughput and the worst
+event loop stall, on the loop, then with 1 to N processes. Then large byte
+payloads, pickled through a pipe or passed through shared memory.
+
+"""
+
+import argparse
+import asyncio
+import hashlib
+import os
+import time
+
+import pipeline
+from pipeline import Pipeline
+
+
+def stretch(item):
+    # About 5 ms of CPU per item
+    return hashlib.pbkdf2_hmac("sha256", str(item).encode(), b"salt", 10_000).hex()
+
+
+def digest(data):
+    return hashlib.sha256(data).digest()
+
+
+async def heartbeat(stalls):
+    # Record how late the event loop wakes up a task sleeping 1 ms
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(0.001)
+        stalls.append(time.perf_counter() - start - 0.001)
+
+
+async def measure(source, transform, **options):
+    stalls = []
+    monitor = asyncio.create_task(heartbeat(stalls))
+    results = []
+    start = time.perf_counter()
+    await Pipeline().add(transform, **options).add(results.append).run(source)
+    elapsed = time.perf_counter() - start
+    monitor.cancel()
+    return len(results), elapsed, max(stalls, default=0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--items", type=int, default=200)
+    parser.add_argument("--payloads", type=int, default=64)
+    parser.add_argument("--payload-size", type=int, default=4, metavar="MB")
+    args = parser.parse_args()
+
+    print(f"{os.cpu_count()} CPU cores\n")
+    print(f"{'stage':>12} {'items/s':>9} {'worst stall ms':>15}")
+    runs = [("event loop", {})]
+    runs += [(f"{n} processes", {"cpu_bound": True, "workers": n})
+             for n in sorted({1, 2, os.cpu_count()})]
+    for name, options in runs:
+        count, elapsed, stall = asyncio.run(measure(range(args.items), stretch, **options))
+        print(f"{name:>12} {count / elapsed:>9,.0f} {stall * 1000:>15.1f}")
+
+    payloads = [os.urandom(args.payload_size << 20) for _ in range(args.payloads)]
+    total = args.payloads * args.payload_size
+    print(f"\n{'payloads':>12} {'MB/s':>9}")
+    for name, minimum in [("pickled", float("inf")), ("shared", 1 << 20)]:
+        pipeline.SHARED_MEMORY_MIN = minimum
+        count, elapsed, _ = asyncio.run(measure(payloads, digest, cpu_bound=True))
+        print(f"{name:>12} {total / elapsed:>9,.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,45 +1,114 @@
+import argparse
 import asyncio
+import resource
+import sys
+import time
 
+from pipeline import Pipeline
+from streams import BlockSink, open_source
 
-async def stage_a_input(queue_ab):
-    items = ["hello", "world", "this", "is", "an", "async", "pipeline"]
-    for item in items:
-        await queue_ab.put(item)
-    await queue_ab.put(None)   # sentinel
+# Seconds each item spends in stage B, standing in for slow I/O such as a
+# network call; 0 to disable.
+IO_DELAY = 0
 
+# Concurrent workers in stage B, and items waiting between stages, at most.
+WORKERS = 1
+QUEUE_SIZE = 10
 
-async def stage_b_uppercase(queue_ab, queue_bc):
-    while True:
-        item = await queue_ab.get()
-        if item is None:
-            await queue_bc.put(None)
-            queue_ab.task_done()
-            break
+# Items per batch, 1 to process items one by one, and seconds an item may
+# wait for its batch to fill.
+BATCH_SIZE = 1
+BATCH_TIMEOUT = 0.005
 
-        await queue_bc.put(item.upper())
-        queue_ab.task_done()
+# Lines to read, from a file or "-" for stdin, instead of the built-in words,
+# and where to write results, "-" for stdout. MMAP reads the file through a
+# memory map, without copying lines.
+INPUT = None
+OUTPUT = "-"
+MMAP = False
 
 
-async def stage_c_reverse(queue_bc):
-    while True:
-        item = await queue_bc.get()
-        if item is None:
-            queue_bc.task_done()
-            break
+def stage_a_input():
+    items = [b"hello", b"world", b"this", b"is", b"an", b"async", b"pipeline"]
+    yield from items
 
-        print(item[::-1])
-        queue_bc.task_done()
 
+async def stage_b_uppercase(item):
+    if IO_DELAY:
+        await asyncio.sleep(IO_DELAY)
+    # bytes() copies memoryviews from a memory-mapped source, not bytes
+    return bytes(item).upper()
+
+
+def stage_c_reverse(item):
+    return item[::-1]
+
+
+def stage_b_uppercase_batch(items):
+    # One call to bytes.upper() for the whole batch; lines have no newlines
+    return b"\n".join(items).upper().split(b"\n")
 
-async def main():
-    queue_ab = asyncio.Queue()
-    queue_bc = asyncio.Queue()
 
-    task_a = asyncio.create_task(stage_a_input(queue_ab))
-    task_b = asyncio.create_task(stage_b_uppercase(queue_ab, queue_bc))
-    task_c = asyncio.create_task(stage_c_reverse(queue_bc))
+def stage_c_reverse_batch(items):
+    return [item[::-1] for item in items]
+
+
+def build(batch_size=1, batch_timeout=0, sink=None):
+    # Results go to sink, or are discarded
+    pipeline = Pipeline()
+    if batch_size > 1:
+        pipeline.add(stage_b_uppercase_batch, workers=WORKERS, queue_size=QUEUE_SIZE,
+                     batch_size=batch_size, batch_timeout=batch_timeout)
+        pipeline.add(stage_c_reverse_batch, queue_size=QUEUE_SIZE,
+                     batch_size=batch_size, batch_timeout=batch_timeout)
+        if sink is not None:
+            pipeline.add(sink.write_batch, queue_size=QUEUE_SIZE,
+                         batch_size=batch_size, batch_timeout=batch_timeout)
+    else:
+        pipeline.add(stage_b_uppercase, workers=WORKERS, queue_size=QUEUE_SIZE)
+        pipeline.add(stage_c_reverse, queue_size=QUEUE_SIZE)
+        if sink is not None:
+            pipeline.add(sink.write, queue_size=QUEUE_SIZE)
+    return pipeline
+
+
+async def main():
+    source = stage_a_input() if INPUT is None else open_source(INPUT, mmap=MMAP)
+    sink = BlockSink(OUTPUT)
+    start = time.perf_counter()
+    try:
+        await build(BATCH_SIZE, BATCH_TIMEOUT, sink).run(source)
+    finally:
+        await sink.close()
+    elapsed = time.perf_counter() - start
+    if INPUT is not None:
+        # On stderr, to keep it out of the output; ru_maxrss is in KiB on Linux
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        print(f"{source.bytes_read / 1e6:,.1f} MB in {elapsed:.2f} s:"
+              f" {source.bytes_read / 1e6 / elapsed:,.1f} MB/s,"
+              f" peak memory {peak:,.0f} MB", file=sys.stderr)
 
-    await asyncio.gather(task_a, task_b, task_c)
 
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=WORKERS,
+                        help="concurrent workers in stage B")
+    parser.add_argument("--delay", type=float, default=IO_DELAY,
+                        help="seconds of simulated I/O per item in stage B")
+    parser.add_argument("--queue-size", type=int, default=QUEUE_SIZE)
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE,
+                        help="items per batch, 1 to disable batching")
+    parser.add_argument("--batch-timeout", type=float, default=BATCH_TIMEOUT * 1000, metavar="MS",
+                        help="milliseconds an item may wait for its batch to fill")
+    parser.add_argument("--input", default=INPUT, metavar="PATH",
+                        help="file to read lines from, - for stdin")
+    parser.add_argument("--output", default=OUTPUT, metavar="PATH",
+                        help="file to write results to, - for stdout")
+    parser.add_argument("--mmap", action="store_true", default=MMAP,
+                        help="read the input file through a memory map")
+    args = parser.parse_args()
+    WORKERS, IO_DELAY, QUEUE_SIZE = args.workers, args.delay, args.queue_size
+    BATCH_SIZE, BATCH_TIMEOUT = args.batch_size, args.batch_timeout / 1000
+    INPUT, OUTPUT, MMAP = args.input, args.output, args.mmap
 
-asyncio.run(main())
+    asyncio.run(main())
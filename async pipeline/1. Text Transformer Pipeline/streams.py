@@ -0,0 +1,182 @@
+"""
+Sources reading lines from files or stdin, and sinks writing them.
+
+Sources read in large chunks and split lines one chunk at a time, so memory
+use doesn't depend on the size of the input. They provide :meth:`batches`,
+which :class:`~pipeline.Pipeline` uses to pass each chunk's lines on in one
+operation. Lines are bytes without the newline.
+
+Sinks gather lines into large blocks, written by a background thread while
+the pipeline keeps running.
+
+"""
+
+__all__ = ["LineSource", "MmapLineSource", "BlockSink", "open_source"]
+
+import asyncio
+import mmap
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+CHUNK_SIZE = 1 << 20
+BLOCK_SIZE = 1 << 20
+
+# Chunks of a memory-mapped file kept in memory behind the read position.
+DROP_BEHIND = 16
+
+
+class LineSource:
+    """
+    Lines of a file, or of stdin for ``-``, read ``chunk_size`` bytes at a time.
+
+    Reads run in a thread, so a slow disk or pipe doesn't stall the event
+    loop. :attr:`bytes_read` counts the input consumed so far.
+
+    """
+
+    def __init__(self, path="-", chunk_size=CHUNK_SIZE):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.bytes_read = 0
+
+    async def batches(self):
+        file = sys.stdin.buffer if self.path == "-" else open(self.path, "rb")
+        remainder = b""
+        try:
+            while chunk := await asyncio.to_thread(file.read, self.chunk_size):
+                self.bytes_read += len(chunk)
+                # The last line may continue in the next chunk
+                lines = (remainder + chunk).split(b"\n")
+                remainder = lines.pop()
+                if lines:
+                    yield lines
+            if remainder:
+                yield [remainder]
+        finally:
+            if file is not sys.stdin.buffer:
+                file.close()
+
+    async def __aiter__(self):
+        async for batch in self.batches():
+            for line in batch:
+                yield line
+
+
+class MmapLineSource:
+    """
+    Lines of a file as memoryview slices of a memory map, without copying.
+
+    Views stay valid while referenced. Stages that need bytes, e.g. to call
+    ``upper()``, convert them. Pages already read are dropped from memory as
+    the source moves on; if a view still needs them, they're read again
+    from the file.
+
+    """
+
+    def __init__(self, path, chunk_size=CHUNK_SIZE):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.bytes_read = 0
+
+    async def batches(self):
+        with open(self.path, "rb") as file:
+            size = os.fstat(file.fileno()).st_size
+            if size == 0:
+                return
+            memory = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if hasattr(mmap, "MADV_SEQUENTIAL"):
+            memory.madvise(mmap.MADV_SEQUENTIAL)
+        view = memoryview(memory)
+        find = memory.find
+        start = 0
+        while start < size:
+            # One chunk's worth of lines; find() runs in C, slicing copies nothing
+            limit = min(start + self.chunk_size, size)
+            lines = []
+            append = lines.append
+            while start < limit:
+                end = find(b"\n", start)
+                if end < 0:
+                    end = size
+                append(view[start:end])
+                start = end + 1
+            self.bytes_read = min(start, size)
+            # Keep resident memory flat: drop pages more than a few chunks
+            # behind. Stages lagging further fault some back in, so drop
+            # everything behind each time; pages already dropped cost little.
+            behind = (start - DROP_BEHIND * self.chunk_size) // mmap.PAGESIZE * mmap.PAGESIZE
+            if hasattr(mmap, "MADV_DONTNEED") and behind > 0:
+                memory.madvise(mmap.MADV_DONTNEED, 0, behind)
+            yield lines
+        view.release()
+        # The map is unmapped once the last view is gone
+
+    async def __aiter__(self):
+        async for batch in self.batches():
+            for line in batch:
+                yield line
+
+
+def open_source(path, mmap=False, chunk_size=CHUNK_SIZE):
+    # stdin and pipes can't be memory-mapped
+    if mmap and path != "-":
+        return MmapLineSource(path, chunk_size)
+    return LineSource(path, chunk_size)
+
+
+class BlockSink:
+    """
+    Write lines to a file, or to stdout for ``-``, in blocks of ``block_size``.
+
+    A thread writes one block while the next one fills; when it falls behind,
+    :meth:`write` waits, so at most two blocks are in memory. Call
+    :meth:`close` at the end to write what's left.
+
+    """
+
+    def __init__(self, path="-", block_size=BLOCK_SIZE):
+        self.file = sys.stdout.buffer if path == "-" else open(path, "wb")
+        self.block_size = block_size
+        self.parts = []
+        self.size = 0
+        self.bytes_written = 0
+        self.executor = ThreadPoolExecutor(1)
+        self.writing = None
+
+    async def write(self, line):
+        self.parts += (line, b"\n")
+        self.size += len(line) + 1
+        if self.size >= self.block_size:
+            await self.flush()
+
+    async def write_batch(self, lines):
+        if not lines:
+            return
+        # One join() for the whole batch, rather than one append per line
+        self.parts += (b"\n".join(lines), b"\n")
+        self.size += len(self.parts[-2]) + 1
+        if self.size >= self.block_size:
+            await self.flush()
+
+    async def flush(self):
+        # join() accepts memoryviews: lines from a memory map are copied
+        # here, once
+        block = b"".join(self.parts)
+        self.parts, self.size = [], 0
+        if self.writing is not None:
+            await self.writing
+        self.writing = asyncio.get_running_loop().run_in_executor(
+            self.executor, self.file.write, block
+        )
+        self.bytes_written += len(block)
+
+    async def close(self):
+        if self.parts:
+            await self.flush()
+        if self.writing is not None:
+            await self.writing
+        self.file.flush()
+        if self.file is not sys.stdout.buffer:
+            self.file.close()
+        self.executor.shutdown()
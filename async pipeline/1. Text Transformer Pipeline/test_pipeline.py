@@ -0,0 +1,78 @@
+"""
+Tests for pipeline.py.
+
+    python -m unittest test_pipeline
+
+"""
+
+import asyncio
+import unittest
+
+from pipeline import Pipeline, Stage
+
+
+def fail_on_three(item):
+    if item == 3:
+        raise RuntimeError("boom")
+    return item
+
+
+async def slow(item):
+    await asyncio.sleep(0.01)
+    return item
+
+
+def double_all(items):
+    return [item * 2 for item in items]
+
+
+def drop_last(items):
+    return items[:-1]
+
+
+class FailureTests(unittest.IsolatedAsyncioTestCase):
+    async def assertFailsCleanly(self, pipeline, source):
+        # The stage's exception propagates, and no task is left behind
+        with self.assertRaisesRegex(RuntimeError, "boom"):
+            await pipeline.run(source)
+        await asyncio.sleep(0)
+        self.assertEqual(asyncio.all_tasks() - {asyncio.current_task()}, set())
+
+    async def test_failing_stage_with_workers(self):
+        pipeline = Pipeline().add(slow, workers=4).add(fail_on_three, workers=2).add(slow)
+        await self.assertFailsCleanly(pipeline, range(100))
+
+    async def test_failing_batch_stage(self):
+        def fail_batch(items):
+            return [fail_on_three(item) for item in items]
+
+        pipeline = Pipeline().add(slow, workers=4).add(fail_batch, batch_size=10, workers=2)
+        await self.assertFailsCleanly(pipeline, range(100))
+
+    async def test_failing_cpu_bound_stage(self):
+        # Worker processes import this module: transforms are top-level
+        pipeline = Pipeline().add(slow, workers=4).add(fail_on_three, cpu_bound=True, workers=2, reorder_size=2)
+        await self.assertFailsCleanly(pipeline, range(100))
+
+
+class BranchesTests(unittest.IsolatedAsyncioTestCase):
+    async def test_batched_branches(self):
+        records = []
+        pipeline = (
+            Pipeline()
+            .add_branches(Stage(double_all, name="double"), Stage(list, name="same"), batch_size=10, window=20)
+            .add(records.append)
+        )
+        await pipeline.run(range(95))
+        self.assertEqual(records, [{"double": item * 2, "same": item} for item in range(95)])
+
+    async def test_branch_dropping_results(self):
+        pipeline = Pipeline().add_branches(double_all, drop_last, batch_size=10)
+        with self.assertRaisesRegex(ValueError, "one result per item"):
+            await pipeline.run(range(100))
+        await asyncio.sleep(0)
+        self.assertEqual(asyncio.all_tasks() - {asyncio.current_task()}, set())
+
+
+if __name__ == "__main__":
+    unittest.main()
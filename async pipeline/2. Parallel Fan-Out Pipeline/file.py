@@ -1,76 +1,137 @@
+import argparse
 import asyncio
+import resource
+import sys
+import time
 
+from pipeline import Pipeline, Stage
+from streams import BlockSink, open_source
 
-# ---------------- Stage A: Fan-out ----------------
-async def stage_a_fanout(queue_b, queue_c):
-    items = ["hello", "world", "this", "is", "an", "async", "pipeline"]
+# Seconds each item, or batch, spends in the reverse branch, to make it lag
+# behind the uppercase branch; 0 to disable.
+LAG = 0
 
-    for item in items:
-        await queue_b.put(item)
-        await queue_c.put(item)
+# Items between the fan-out and the join, at most, and items waiting in
+# each queue.
+WINDOW = 10
+QUEUE_SIZE = 10
 
-    # One sentinel per branch
-    await queue_b.put(None)
-    await queue_c.put(None)
+# Items per batch, 1 to process items one by one, and seconds an item may
+# wait for its batch to fill. Batches are capped to the window.
+BATCH_SIZE = 1
+BATCH_TIMEOUT = 0.005
 
+# Lines to read, from a file or "-" for stdin, instead of the built-in words,
+# and where to write results, "-" for stdout. MMAP reads the file through a
+# memory map, without copying lines.
+INPUT = None
+OUTPUT = "-"
+MMAP = False
 
-# ---------------- Stage B1: Uppercase ----------------
-async def stage_b1_uppercase(queue_b, queue_merge):
-    while True:
-        item = await queue_b.get()
-
-        if item is None:
-            await queue_merge.put(None)   # forward sentinel
-            queue_b.task_done()
-            break
 
-        await queue_merge.put(item.upper())
-        queue_b.task_done()
+# ---------------- Stage A: Source ----------------
+def stage_a_fanout():
+    items = [b"hello", b"world", b"this", b"is", b"an", b"async", b"pipeline"]
+    yield from items
 
 
-# ---------------- Stage B2: Reverse ----------------
-async def stage_b2_reverse(queue_c, queue_merge):
-    while True:
-        item = await queue_c.get()
+# ---------------- Stage B1: Uppercase ----------------
+def stage_b1_uppercase(item):
+    # bytes() copies memoryviews from a memory-mapped source, not bytes
+    return bytes(item).upper()
 
-        if item is None:
-            await queue_merge.put(None)   # forward sentinel
-            queue_c.task_done()
-            break
 
-        await queue_merge.put(item[::-1])
-        queue_c.task_done()
+# ---------------- Stage B2: Reverse ----------------
+async def stage_b2_reverse(item):
+    if LAG:
+        await asyncio.sleep(LAG)
+    return bytes(item)[::-1]
 
 
 # ---------------- Stage C: Merge ----------------
-async def stage_c_merge(queue_merge):
-    counter = 0
+def stage_c_merge(record):
+    # One record per input item, in input order
+    return b"OUTPUT: %s %s" % (record["uppercase"], record["reverse"])
 
-    while True:
-        item = await queue_merge.get()
 
-        if item is None:
-            counter += 1
-            queue_merge.task_done()
-            if counter == 2:   # number of branches
-                break
-        else:
-            print("OUTPUT:", item)
-            queue_merge.task_done()
+# ---------------- Batched Stages ----------------
+def stage_b1_uppercase_batch(items):
+    # One call to bytes.upper() for the whole batch; lines have no newlines
+    return b"\n".join(items).upper().split(b"\n")
 
 
-# ---------------- Coordinator ----------------
-async def main():
-    queue_b = asyncio.Queue()
-    queue_c = asyncio.Queue()
-    queue_merge = asyncio.Queue()
+async def stage_b2_reverse_batch(items):
+    if LAG:
+        await asyncio.sleep(LAG)
+    return [bytes(item)[::-1] for item in items]
+
 
-    await asyncio.gather(
-        stage_a_fanout(queue_b, queue_c),
-        stage_b1_uppercase(queue_b, queue_merge),
-        stage_b2_reverse(queue_c, queue_merge),
-        stage_c_merge(queue_merge),
-    )
+def stage_c_merge_batch(records):
+    return [b"OUTPUT: %s %s" % (record["uppercase"], record["reverse"]) for record in records]
 
 
-asyncio.run(main())
+# ---------------- Coordinator ----------------
+async def main():
+    source = stage_a_fanout() if INPUT is None else open_source(INPUT, mmap=MMAP)
+    sink = BlockSink(OUTPUT)
+    pipeline = Pipeline()
+    # Any number of branches; each item is sent to all of them
+    if BATCH_SIZE > 1:
+        pipeline.add_branches(
+            Stage(stage_b1_uppercase_batch, name="uppercase", queue_size=QUEUE_SIZE),
+            Stage(stage_b2_reverse_batch, name="reverse", queue_size=QUEUE_SIZE),
+            window=WINDOW,
+            queue_size=QUEUE_SIZE,
+            batch_size=BATCH_SIZE,
+            batch_timeout=BATCH_TIMEOUT,
+        )
+        pipeline.add(stage_c_merge_batch, queue_size=QUEUE_SIZE,
+                     batch_size=BATCH_SIZE, batch_timeout=BATCH_TIMEOUT)
+        pipeline.add(sink.write_batch, queue_size=QUEUE_SIZE,
+                     batch_size=BATCH_SIZE, batch_timeout=BATCH_TIMEOUT)
+    else:
+        pipeline.add_branches(
+            Stage(stage_b1_uppercase, name="uppercase", queue_size=QUEUE_SIZE),
+            Stage(stage_b2_reverse, name="reverse", queue_size=QUEUE_SIZE),
+            window=WINDOW,
+            queue_size=QUEUE_SIZE,
+        )
+        pipeline.add(stage_c_merge, queue_size=QUEUE_SIZE)
+        pipeline.add(sink.write, queue_size=QUEUE_SIZE)
+    start = time.perf_counter()
+    try:
+        await pipeline.run(source)
+    finally:
+        await sink.close()
+    elapsed = time.perf_counter() - start
+    if INPUT is not None:
+        # On stderr, to keep it out of the output; ru_maxrss is in KiB on Linux
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        print(f"{source.bytes_read / 1e6:,.1f} MB in {elapsed:.2f} s:"
+              f" {source.bytes_read / 1e6 / elapsed:,.1f} MB/s,"
+              f" peak memory {peak:,.0f} MB", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lag", type=float, default=LAG,
+                        help="seconds per item, or batch, in the reverse branch")
+    parser.add_argument("--window", type=int, default=WINDOW,
+                        help="items between the fan-out and the join, at most")
+    parser.add_argument("--queue-size", type=int, default=QUEUE_SIZE)
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE,
+                        help="items per batch, 1 to disable batching")
+    parser.add_argument("--batch-timeout", type=float, default=BATCH_TIMEOUT * 1000, metavar="MS",
+                        help="milliseconds an item may wait for its batch to fill")
+    parser.add_argument("--input", default=INPUT, metavar="PATH",
+                        help="file to read lines from, - for stdin")
+    parser.add_argument("--output", default=OUTPUT, metavar="PATH",
+                        help="file to write results to, - for stdout")
+    parser.add_argument("--mmap", action="store_true", default=MMAP,
+                        help="read the input file through a memory map")
+    args = parser.parse_args()
+    LAG, WINDOW, QUEUE_SIZE = args.lag, args.window, args.queue_size
+    BATCH_SIZE, BATCH_TIMEOUT = args.batch_size, args.batch_timeout / 1000
+    INPUT, OUTPUT, MMAP = args.input, args.output, args.mmap
+
+    asyncio.run(main())
@@ -0,0 +1,616 @@
+"""
+Reusable async pipeline: a source, then stages connected by bounded channels.
+
+Each stage runs a transform in N concurrent workers. Channels are closed
+rather than fed sentinels: when every worker of a stage is done, the stage
+closes its output channel, and downstream workers stop once they've drained
+it. Shutdown therefore runs from the source to the last stage, whatever the
+number of workers.
+
+    pipeline = Pipeline()
+    pipeline.add(fetch, workers=8)   # slow I/O: many workers
+    pipeline.add(store)
+    await pipeline.run(urls)
+
+For small items, the cost of a channel operation per item dominates. A
+stage with ``batch_size`` > 1 takes up to that many items at once, waiting
+at most ``batch_timeout`` seconds for a batch to fill, hands them to its
+transform as a list, and passes the results on in one operation.
+
+A stage with ``cpu_bound=True`` runs its transform in a process pool, so it
+uses every core and doesn't stall the event loop. Results come out in input
+order, and large byte payloads go through shared memory.
+
+Branches apply several stages to every item in parallel, then join their
+results back into one record per item, in input order:
+
+    pipeline.add_branches(Stage(uppercase), Stage(reverse), window=100)
+
+"""
+
+__all__ = ["Channel", "ChannelClosed", "Stage", "Branches", "Pipeline", "SharedBytes"]
+
+import asyncio
+import collections
+import contextlib
+import copy
+import functools
+import inspect
+import itertools
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+
+# Byte payloads at least this large go to and from CPU-bound stages through
+# shared memory instead of being pickled and sent through a pipe.
+SHARED_MEMORY_MIN = 1 << 20
+
+
+class ChannelClosed(Exception):
+    """
+    Raised by :meth:`Channel.get` when the channel is closed and empty.
+
+    """
+
+
+class Channel:
+    """
+    Bounded FIFO channel between stages, which producers close when done.
+
+    :meth:`put` waits while the channel is full, so a fast producer is slowed
+    down to the pace of its consumers and memory stays bounded.
+
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.items = collections.deque()
+        self.closed = False
+        # Both conditions share a lock, so each operation wakes only waiters
+        # of the other kind
+        lock = asyncio.Lock()
+        self.not_full = asyncio.Condition(lock)
+        self.not_empty = asyncio.Condition(lock)
+
+    def qsize(self):
+        return len(self.items)
+
+    async def put(self, item):
+        async with self.not_full:
+            await self.not_full.wait_for(lambda: len(self.items) < self.maxsize)
+            if self.closed:
+                raise RuntimeError("put on a closed channel")
+            self.items.append(item)
+            self.not_empty.notify()
+
+    async def put_many(self, items):
+        # Wait for room, then add all items in one operation; the channel
+        # may exceed its size by one batch
+        async with self.not_full:
+            await self.not_full.wait_for(lambda: len(self.items) < self.maxsize)
+            if self.closed:
+                raise RuntimeError("put on a closed channel")
+            self.items.extend(items)
+            self.not_empty.notify(len(items))
+
+    async def get(self):
+        async with self.not_empty:
+            await self.not_empty.wait_for(lambda: self.items or self.closed)
+            if not self.items:
+                raise ChannelClosed
+            item = self.items.popleft()
+            self.not_full.notify()
+            return item
+
+    async def get_many(self, size, timeout):
+        """
+        Take up to ``size`` items.
+
+        Once an item is available, wait at most ``timeout`` seconds for more,
+        so no item waits longer than that for its batch to fill.
+
+        """
+        async with self.not_empty:
+            await self.not_empty.wait_for(lambda: self.items or self.closed)
+            if not self.items:
+                raise ChannelClosed
+            # Producers can't add more once the channel is full: no point
+            # waiting beyond that
+            enough = min(size, self.maxsize)
+            if len(self.items) < enough and timeout:
+                try:
+                    await asyncio.wait_for(
+                        self.not_empty.wait_for(lambda: len(self.items) >= enough or self.closed),
+                        timeout,
+                    )
+                except asyncio.TimeoutError:
+                    pass
+            count = min(size, len(self.items))
+            if count == len(self.items):
+                batch = list(self.items)
+                self.items.clear()
+            else:
+                popleft = self.items.popleft
+                batch = [popleft() for _ in range(count)]
+            self.not_full.notify(count)
+            return batch
+
+    async def drain(self):
+        # Take every item at once, e.g. to free them when the pipeline fails
+        async with self.not_full:
+            items = list(self.items)
+            self.items.clear()
+            self.not_full.notify_all()
+            return items
+
+    async def close(self):
+        # Consumers finish what's left, then get ChannelClosed
+        async with self.not_empty:
+            self.closed = True
+            self.not_empty.notify_all()
+
+
+async def gather_all(*coros):
+    """
+    Run coroutines concurrently, like :func:`asyncio.gather`.
+
+    If one fails, or the caller is cancelled, the others are cancelled and
+    awaited before the exception propagates, so no task outlives the call.
+
+    """
+    tasks = [asyncio.ensure_future(coro) for coro in coros]
+    try:
+        return await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+class SharedBytes:
+    """
+    Bytes copied into shared memory, passed between processes by name.
+
+    Pickling a handle costs nothing, whatever the size of the bytes.
+
+    """
+
+    def __init__(self, data):
+        self.size = len(data) if isinstance(data, (bytes, bytearray)) else data.nbytes
+        memory = SharedMemory(create=True, size=max(self.size, 1))
+        memory.buf[:self.size] = data
+        self.name = memory.name
+        # The block outlives this mapping until unlink()
+        memory.close()
+
+    @contextlib.contextmanager
+    def view(self):
+        # Zero-copy memoryview, valid until the end of the with block
+        memory = SharedMemory(self.name)
+        view = memory.buf[:self.size]
+        try:
+            yield view
+        finally:
+            view.release()
+            memory.close()
+
+    def load(self):
+        # Copy out, then free the block
+        with self.view() as view:
+            data = bytes(view)
+        self.unlink()
+        return data
+
+    def unlink(self):
+        memory = SharedMemory(self.name)
+        memory.close()
+        memory.unlink()
+
+
+def share(value):
+    # Move large byte payloads to shared memory, item by item in batches
+    if isinstance(value, list):
+        return [share(item) for item in value]
+    if isinstance(value, (bytes, bytearray)) and len(value) >= SHARED_MEMORY_MIN:
+        return SharedBytes(value)
+    if isinstance(value, memoryview):
+        # Views can't be pickled
+        return SharedBytes(value) if value.nbytes >= SHARED_MEMORY_MIN else value.tobytes()
+    return value
+
+
+def unshare(value):
+    if isinstance(value, list):
+        return [unshare(item) for item in value]
+    if isinstance(value, SharedBytes):
+        return value.load()
+    return value
+
+
+def call_shared(transform, value):
+    # Runs in a worker process. The transform gets payloads in shared memory
+    # as memoryviews, which it must not keep.
+    with contextlib.ExitStack() as stack:
+        if isinstance(value, list):
+            value = [
+                stack.enter_context(item.view()) if isinstance(item, SharedBytes) else item
+                for item in value
+            ]
+        elif isinstance(value, SharedBytes):
+            value = stack.enter_context(value.view())
+        # Copy results out before the views are released
+        return share(transform(value))
+
+
+def release(value):
+    # Free the shared memory of inputs once the worker is done with them
+    for item in value if isinstance(value, list) else [value]:
+        if isinstance(item, SharedBytes):
+            item.unlink()
+
+
+def start_pool(workers):
+    # Start the resource tracker first, so workers share it with this
+    # process. Otherwise each worker starts its own, which reports blocks
+    # this process unlinks as leaked.
+    resource_tracker.ensure_running()
+    # Source and sink threads may be running: fork workers from a
+    # single-threaded server process, not from this one
+    executor = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("forkserver"))
+    # Starting processes takes tens of milliseconds: called in a thread,
+    # this keeps it off the event loop
+    executor.submit(int).result()
+    return executor
+
+
+def discard(future):
+    # Free the shared memory of a result nobody will collect, once it's ready
+    def done(future):
+        if not future.cancelled() and future.exception() is None:
+            release(future.result())
+
+    future.add_done_callback(done)
+
+
+class Stage:
+    """
+    A transform applied to every item by ``workers`` concurrent workers.
+
+    ``transform`` is a function or a coroutine function taking an item and
+    returning the item for the next stage. With more than one worker, items
+    may leave the stage in a different order than they came in.
+
+    ``queue_size`` bounds the channel feeding the stage.
+
+    With ``batch_size`` > 1, ``transform`` takes a list of up to that many
+    items and returns a list of results, or :obj:`None` in the last stage.
+    A batch is processed as soon as it's full or ``batch_timeout`` seconds
+    after its first item was available.
+
+    With ``cpu_bound=True``, ``transform`` must be a plain function that can
+    be pickled, e.g. defined at the top level of a module. It runs in
+    ``workers`` processes, by default one per core, and results leave the
+    stage in input order. Up to ``reorder_size`` items, by default twice the
+    number of processes, may be in flight or done and waiting for an earlier
+    one; beyond that, the stage stops taking input.
+
+    """
+
+    def __init__(
+        self,
+        transform,
+        workers=None,
+        queue_size=100,
+        name=None,
+        batch_size=1,
+        batch_timeout=0,
+        cpu_bound=False,
+        reorder_size=None,
+    ):
+        self.transform = transform
+        self.cpu_bound = cpu_bound
+        if workers is None:
+            workers = os.cpu_count() if cpu_bound else 1
+        self.workers = workers
+        self.queue_size = queue_size
+        self.name = name or transform.__name__
+        self.batch_size = batch_size
+        self.batch_timeout = batch_timeout
+        self.reorder_size = reorder_size or 2 * workers
+        self.is_async = inspect.iscoroutinefunction(transform)
+
+    async def work_batches(self, inbox, outbox):
+        while True:
+            try:
+                batch = await inbox.get_many(self.batch_size, self.batch_timeout)
+            except ChannelClosed:
+                return
+            results = self.transform(batch)
+            if self.is_async:
+                results = await results
+            if outbox is not None:
+                await outbox.put_many(results)
+
+    async def work(self, inbox, outbox):
+        if self.batch_size > 1:
+            await self.work_batches(inbox, outbox)
+            return
+        while True:
+            try:
+                item = await inbox.get()
+            except ChannelClosed:
+                return
+            result = self.transform(item)
+            if self.is_async:
+                result = await result
+            if outbox is not None:
+                await outbox.put(result)
+
+    async def take(self, inbox):
+        # Next item, or batch of items
+        if self.batch_size > 1:
+            return await inbox.get_many(self.batch_size, self.batch_timeout)
+        return await inbox.get()
+
+    async def dispatch(self, inbox, pending, executor):
+        # Submit items in order; the bounded channel of futures is the
+        # reorder buffer
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                value = share(await self.take(inbox))
+            except ChannelClosed:
+                break
+            future = loop.run_in_executor(executor, call_shared, self.transform, value)
+            try:
+                await pending.put((future, value))
+            except asyncio.CancelledError:
+                release(value)
+                discard(future)
+                raise
+        await pending.close()
+
+    async def collect(self, pending, outbox):
+        # Wait for results in submission order, whatever order they finish in
+        while True:
+            try:
+                future, value = await pending.get()
+            except ChannelClosed:
+                return
+            try:
+                result = unshare(await future)
+            except asyncio.CancelledError:
+                discard(future)
+                raise
+            finally:
+                release(value)
+            if outbox is None:
+                continue
+            if self.batch_size > 1:
+                await outbox.put_many(result)
+            else:
+                await outbox.put(result)
+
+    async def run_in_processes(self, inbox, outbox):
+        pending = Channel(self.reorder_size)
+        executor = await asyncio.to_thread(start_pool, self.workers)
+        try:
+            await gather_all(
+                self.dispatch(inbox, pending, executor),
+                self.collect(pending, outbox),
+            )
+        except BaseException:
+            # The pipeline is failing: drop remaining work and free the
+            # shared memory of items waiting in the reorder buffer
+            executor.shutdown(wait=False, cancel_futures=True)
+            for future, value in await pending.drain():
+                release(value)
+                discard(future)
+            raise
+        # Everything is done: wait for the processes to exit, off the loop
+        await asyncio.get_running_loop().run_in_executor(None, executor.shutdown)
+
+    async def process(self, inbox, outbox):
+        # Process items until the inbox is closed and drained
+        if self.cpu_bound:
+            await self.run_in_processes(inbox, outbox)
+        else:
+            await gather_all(*[self.work(inbox, outbox) for _ in range(self.workers)])
+
+    async def run(self, inbox, outbox):
+        await self.process(inbox, outbox)
+        # Every worker is done: nothing more will come out of this stage
+        if outbox is not None:
+            await outbox.close()
+
+
+def call_tagged(index, transform, pair):
+    # Branch transform: keep track of the branch and the item
+    seq, item = pair
+    return index, seq, transform(item)
+
+
+async def call_tagged_async(index, transform, pair):
+    seq, item = pair
+    return index, seq, await transform(item)
+
+
+class Branches:
+    """
+    Stages applied to every item in parallel, joined into one record per item.
+
+    The fan-out numbers items and sends each one to every branch. The join
+    collects the results of all branches for an item into a dict keyed by
+    stage name, and emits records in input order, whatever order branches
+    finish in. Branch stages may have several workers or be CPU-bound.
+
+    With ``batch_size`` > 1, the fan-out takes up to that many items at
+    once, waiting at most ``batch_timeout`` seconds, and sends the batch to
+    every branch as a list. Branch transforms return a list of results, one
+    per item, and the join emits the batch's records in one operation.
+
+    At most ``window`` items are between the fan-out and the join. When a
+    branch lags, the fan-out waits, rather than the join buffering the
+    results of faster branches without limit. Batches are capped to the
+    window.
+
+    """
+
+    def __init__(self, stages, window=100, queue_size=100, batch_size=1, batch_timeout=0):
+        self.names = [stage.name for stage in stages]
+        if len(set(self.names)) != len(self.names):
+            raise ValueError(f"branch names must be unique: {self.names}")
+        self.stages = [self.tag(index, stage) for index, stage in enumerate(stages)]
+        self.window = window
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.batch_timeout = batch_timeout
+        self.name = " + ".join(self.names)
+
+    @staticmethod
+    def tag(index, stage):
+        # Same stage, with a transform returning (branch, seq, result)
+        call = call_tagged_async if stage.is_async else call_tagged
+        stage = copy.copy(stage)
+        stage.transform = functools.partial(call, index, stage.transform)
+        # Batches are formed by the fan-out: a branch handles one at a time
+        stage.batch_size = 1
+        return stage
+
+    async def fan_out(self, inbox, channels, credits, sizes):
+        # sizes: seq -> number of items, the credits the join must release
+        seq = 0
+        while True:
+            try:
+                if self.batch_size > 1:
+                    item = await inbox.get_many(
+                        min(self.batch_size, self.window), self.batch_timeout
+                    )
+                    count = len(item)
+                else:
+                    item, count = await inbox.get(), 1
+            except ChannelClosed:
+                break
+            # Wait until the join has room for these items
+            for _ in range(count):
+                await credits.acquire()
+            sizes[seq] = count
+            for channel in channels:
+                await channel.put((seq, item))
+            seq += 1
+        for channel in channels:
+            await channel.close()
+
+    async def branch(self, stages, channels, results):
+        # Branches share the results channel: close it after the last one
+        await gather_all(*[
+            stage.process(channel, results) for stage, channel in zip(stages, channels)
+        ])
+        await results.close()
+
+    async def join(self, results, outbox, credits, sizes):
+        records = {}   # seq -> [number of results, results by branch]
+        next_seq = 0
+        while True:
+            try:
+                index, seq, result = await results.get()
+            except ChannelClosed:
+                return
+            record = records.setdefault(seq, [0, [None] * len(self.stages)])
+            record[0] += 1
+            record[1][index] = result
+            # Emit complete records in order
+            while next_seq in records and records[next_seq][0] == len(self.stages):
+                _, values = records.pop(next_seq)
+                size = sizes.pop(next_seq)
+                next_seq += 1
+                # Release as many credits as the fan-out acquired
+                for _ in range(size):
+                    credits.release()
+                if self.batch_size > 1:
+                    # One list of results per branch: one record per item
+                    if any(len(value) != size for value in values):
+                        raise ValueError(
+                            f"branches must return one result per item: {size} items,"
+                            f" {[len(value) for value in values]} results from {self.names}"
+                        )
+                    batch = [dict(zip(self.names, row)) for row in zip(*values)]
+                    if outbox is not None:
+                        await outbox.put_many(batch)
+                    continue
+                if outbox is not None:
+                    await outbox.put(dict(zip(self.names, values)))
+
+    async def run(self, inbox, outbox):
+        credits = asyncio.Semaphore(self.window)
+        channels = [Channel(stage.queue_size) for stage in self.stages]
+        results = Channel(self.queue_size)
+        sizes = {}
+        await gather_all(
+            self.fan_out(inbox, channels, credits, sizes),
+            self.branch(self.stages, channels, results),
+            self.join(results, outbox, credits, sizes),
+        )
+        if outbox is not None:
+            await outbox.close()
+
+
+class Pipeline:
+    """
+    Stages run in the order they were added; results of the last stage are
+    discarded, so it's usually a sink, e.g. writing output.
+
+    """
+
+    def __init__(self):
+        self.stages = []
+
+    def add(self, transform, **options):
+        # Options are those of Stage
+        self.stages.append(Stage(transform, **options))
+        return self
+
+    def add_branches(self, *stages, window=100, queue_size=100, batch_size=1, batch_timeout=0):
+        # Stages or plain transforms, one per branch
+        stages = [stage if isinstance(stage, Stage) else Stage(stage) for stage in stages]
+        self.stages.append(Branches(stages, window, queue_size, batch_size, batch_timeout))
+        return self
+
+    async def feed(self, source, outbox, batch_size):
+        # The source is an iterable or an async iterable. Items of an
+        # iterable are available at once: pass them on in batches. Sources
+        # reading in chunks, such as those in streams.py, provide batches().
+        if hasattr(source, "batches"):
+            async for batch in source.batches():
+                await outbox.put_many(batch)
+        elif hasattr(source, "__aiter__"):
+            async for item in source:
+                await outbox.put(item)
+        elif batch_size == 1:
+            for item in source:
+                await outbox.put(item)
+        else:
+            iterator = iter(source)
+            while batch := list(itertools.islice(iterator, batch_size)):
+                await outbox.put_many(batch)
+        await outbox.close()
+
+    async def run(self, source):
+        """
+        Push every item of ``source`` through the stages.
+
+        Returns when the last stage is done with the last item. If a stage
+        raises an exception, the other stages are cancelled and the
+        exception propagates.
+
+        """
+        if not self.stages:
+            raise ValueError("pipeline has no stages")
+        channels = [Channel(stage.queue_size) for stage in self.stages]
+        coros = [self.feed(source, channels[0], self.stages[0].batch_size)]
+        for index, stage in enumerate(self.stages):
+            outbox = channels[index + 1] if index + 1 < len(channels) else None
+            coros.append(stage.run(channels[index], outbox))
+        await gather_all(*coros)
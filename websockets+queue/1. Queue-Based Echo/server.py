@@ -1,11 +1,193 @@
+import argparse
 import asyncio
+import http
+import itertools
+import time
 import websockets
 
+from connections import ConnectionManager
+from ratelimit import POLICIES, RateLimiter
+
+# Bound of each connection's queue.
+QUEUE_SIZE = 10
+
+# Adaptive mode: resize each queue between these bounds based on how long
+# sends take. Slow sends mean a slow client, so the queue shrinks and the
+# receive task blocks earlier, pushing back on the client through TCP. Fast
+# sends let the queue grow again to absorb bursts.
+ADAPTIVE = False
+MIN_QUEUE_SIZE, MAX_QUEUE_SIZE = 2, 100
+SLOW_SEND, FAST_SEND = 0.010, 0.001   # seconds, averaged over recent sends
+
+# Queues of connected clients, and totals of clients that disconnected.
+queues = {}
+finished = {}
+client_ids = itertools.count(1)
+
+# Connection limits, heartbeats, idle timeouts and graceful shutdown.
+manager = ConnectionManager()
+
+# Limits on incoming messages, set with --rate-limit or --ip-rate-limit;
+# None when there are no limits.
+limiter = None
+
+
+class MeteredQueue:
+    """
+    Bounded FIFO queue recording how it's used.
+
+    Tracks the current and highest depth, the time producers spend blocked
+    in :meth:`put`, the time consumers spend waiting in :meth:`get`, and
+    how long items stay in the queue. The bound can change at any time with
+    :meth:`resize`.
+
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.items = asyncio.Queue()   # (time enqueued, item)
+        self.not_full = asyncio.Condition()
+        self.send_latency = 0.0        # moving average, in seconds
+        self.send_started = None       # start of the send in progress
+
+        self.puts = 0
+        self.gets = 0
+        self.max_depth = 0
+        self.put_time = 0.0
+        self.get_time = 0.0
+        self.wait_time = 0.0
+        self.max_wait = 0.0
+
+    def qsize(self):
+        return self.items.qsize()
+
+    async def put(self, item):
+        start = time.monotonic()
+        # A send stuck for a while counts as slow before it completes
+        if self.send_started is not None and start - self.send_started > SLOW_SEND:
+            await self.adapt(start - self.send_started)
+        async with self.not_full:
+            await self.not_full.wait_for(lambda: self.items.qsize() < self.maxsize)
+            now = time.monotonic()
+            self.items.put_nowait((now, item))
+        self.puts += 1
+        self.put_time += now - start
+        self.max_depth = max(self.max_depth, self.items.qsize())
+
+    async def get(self):
+        start = time.monotonic()
+        enqueued, item = await self.items.get()
+        now = time.monotonic()
+        self.gets += 1
+        self.get_time += now - start
+        self.wait_time += now - enqueued
+        self.max_wait = max(self.max_wait, now - enqueued)
+        async with self.not_full:
+            self.not_full.notify()
+        return item
+
+    def task_done(self):
+        self.items.task_done()
+
+    async def resize(self, maxsize):
+        async with self.not_full:
+            self.maxsize = maxsize
+            self.not_full.notify_all()
+
+    def start_send(self):
+        self.send_started = time.monotonic()
+
+    async def end_send(self):
+        latency = time.monotonic() - self.send_started
+        self.send_started = None
+        self.send_latency = 0.9 * self.send_latency + 0.1 * latency
+        await self.adapt(self.send_latency)
+
+    async def adapt(self, latency):
+        if not ADAPTIVE:
+            return
+        # Shrink fast when the client falls behind, grow slowly
+        if latency > SLOW_SEND and self.maxsize > MIN_QUEUE_SIZE:
+            await self.resize(max(MIN_QUEUE_SIZE, self.maxsize // 2))
+        elif latency < FAST_SEND and self.maxsize < MAX_QUEUE_SIZE:
+            await self.resize(self.maxsize + 1)
+
+    def counters(self):
+        return {
+            "puts": self.puts,
+            "gets": self.gets,
+            "put_time": self.put_time,
+            "get_time": self.get_time,
+            "wait_time": self.wait_time,
+            "max_depth": self.max_depth,
+            "max_wait": self.max_wait,
+        }
+
+
+def add_counters(totals, counters):
+    # Sum counters, except maximums
+    for name, value in counters.items():
+        if name.startswith("max_"):
+            totals[name] = max(totals.get(name, 0), value)
+        else:
+            totals[name] = totals.get(name, 0) + value
+
+
+def stats_line(name, depth, bound, counters, send_latency):
+    gets = counters["gets"] or 1
+    return (
+        f"{name:>8} {depth:>6} {bound:>6} {counters['max_depth']:>6} {counters['puts']:>10}"
+        f" {counters['put_time'] * 1000:>10.1f} {counters['get_time'] * 1000:>10.1f}"
+        f" {counters['wait_time'] / gets * 1000:>8.3f} {counters['max_wait'] * 1000:>8.3f}"
+        f" {send_latency * 1000:>8.3f}"
+    )
+
+
+def stats_text():
+    # Plain text table: one line for the whole server, then one per client.
+    # Times are totals in milliseconds, except averages and maximums.
+    lines = [
+        f"clients: {len(queues)}, adaptive: {'on' if ADAPTIVE else 'off'}",
+        f"{'client':>8} {'depth':>6} {'bound':>6} {'max':>6} {'items':>10}"
+        f" {'put ms':>10} {'get ms':>10} {'wait avg':>8} {'wait max':>8} {'send avg':>8}",
+    ]
+
+    totals = dict(finished)
+    for queue in queues.values():
+        add_counters(totals, queue.counters())
+    if totals:
+        lines.append(stats_line(
+            "all",
+            sum(queue.qsize() for queue in queues.values()),
+            sum(queue.maxsize for queue in queues.values()),
+            totals,
+            max((queue.send_latency for queue in queues.values()), default=0),
+        ))
+
+    for client_id, queue in queues.items():
+        lines.append(stats_line(
+            f"#{client_id}", queue.qsize(), queue.maxsize,
+            queue.counters(), queue.send_latency,
+        ))
+    return "\n".join(lines) + "\n"
+
+
+def process_request(connection, request):
+    # Serve statistics over plain HTTP on the WebSocket port:
+    # curl http://localhost:8765/stats
+    if request.path == "/stats":
+        return connection.respond(http.HTTPStatus.OK, stats_text())
+    # Statistics stay available when the server is full or shutting down
+    return manager.process_request(connection, request)
+
 
 async def receive_message(websocket, queue):
     try:
         while True:
             msg = await websocket.recv()
+            manager.touch(websocket)
+            if limiter is not None and not await limiter.allow(websocket):
+                continue
             await queue.put(msg)
     except asyncio.CancelledError:
         # Task cancelled → exit cleanly
@@ -16,7 +198,9 @@ async def send_message(websocket, queue):
     try:
         while True:
             msg = await queue.get()
+            queue.start_send()
             await websocket.send(msg)
+            await queue.end_send()
             queue.task_done()
     except asyncio.CancelledError:
         # Task cancelled → exit cleanly
@@ -24,7 +208,11 @@ async def send_message(websocket, queue):
 
 
 async def handler(websocket):
-    queue = asyncio.Queue(maxsize=10)  # bounded queue = backpressure
+    queue = MeteredQueue(QUEUE_SIZE)  # bounded queue = backpressure
+    client_id = next(client_ids)
+    queues[client_id] = queue
+    if limiter is not None:
+        limiter.connect(websocket)
     print("Client connected")
 
     receive_task = asyncio.create_task(
@@ -34,25 +222,74 @@ async def handler(websocket):
         send_message(websocket, queue)
     )
 
-    done, pending = await asyncio.wait(
-        {receive_task, send_task},
-        return_when=asyncio.FIRST_EXCEPTION,
-    )
+    try:
+        done, pending = await asyncio.wait(
+            {receive_task, send_task},
+            return_when=asyncio.FIRST_EXCEPTION,
+        )
 
-    # If either task finishes or crashes → cancel the other
-    for task in pending:
-        task.cancel()
+        # If either task finishes or crashes → cancel the other
+        for task in pending:
+            task.cancel()
 
-    # Ensure all tasks fully exit
-    await asyncio.gather(*pending, return_exceptions=True)
+        # Ensure all tasks fully exit
+        await asyncio.gather(*pending, return_exceptions=True)
+
+    finally:
+        # Keep the client's counters in the server-wide totals
+        del queues[client_id]
+        add_counters(finished, queue.counters())
+        if limiter is not None:
+            limiter.disconnect(websocket)
 
     print("Client disconnected, cleanup complete")
 
 
+async def drain():
+    # On shutdown, wait until echoes already queued have been sent
+    while any(
+        queue.qsize() or queue.send_started is not None for queue in queues.values()
+    ):
+        await asyncio.sleep(0.01)
+
+
 async def main():
-    async with websockets.serve(handler, "localhost", 8765):
+    async with websockets.serve(
+        manager.wrap(handler), "localhost", 8765,
+        **dict(manager.serve_options(), process_request=process_request),
+    ) as server:
         print("Server started on ws://localhost:8765")
-        await asyncio.Future()  # run forever
+        print("Statistics at http://localhost:8765/stats")
+        # Until SIGTERM or Ctrl-C
+        await manager.run(server, drain=drain)
+
 
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--queue-size", type=int, default=QUEUE_SIZE)
+    parser.add_argument("--adaptive", action="store_true",
+                        help="resize queues between --min-size and --max-size based on send latency")
+    parser.add_argument("--min-size", type=int, default=MIN_QUEUE_SIZE)
+    parser.add_argument("--max-size", type=int, default=MAX_QUEUE_SIZE)
+    parser.add_argument("--rate-limit", type=float, default=0, metavar="RATE",
+                        help="messages per second per connection, 0 for no limit")
+    parser.add_argument("--burst", type=int, default=10)
+    parser.add_argument("--ip-rate-limit", type=float, default=0, metavar="RATE",
+                        help="messages per second per client IP address, 0 for no limit")
+    parser.add_argument("--ip-burst", type=int, default=50)
+    parser.add_argument("--rate-policy", choices=POLICIES, default="delay",
+                        help="what to do with messages over the limit")
+    parser.add_argument("--max-connections", type=int, default=manager.max_connections)
+    parser.add_argument("--idle-timeout", type=float, default=manager.idle_timeout,
+                        help="seconds without messages before closing, 0 to disable")
+    parser.add_argument("--drain-timeout", type=float, default=manager.drain_timeout,
+                        help="seconds to send queued echoes on shutdown")
+    args = parser.parse_args()
+    manager = ConnectionManager(args.max_connections, args.idle_timeout, args.drain_timeout)
+    QUEUE_SIZE, ADAPTIVE = args.queue_size, args.adaptive
+    MIN_QUEUE_SIZE, MAX_QUEUE_SIZE = args.min_size, args.max_size
+    if args.rate_limit or args.ip_rate_limit:
+        limiter = RateLimiter(args.rate_limit, args.burst,
+                              args.ip_rate_limit, args.ip_burst, args.rate_policy)
 
-asyncio.run(main())
+    asyncio.run(main())
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+
+"""
+Compare bounded priority buffers that drop the lowest priority when full.
+
+    python benchmark.py [--sizes 10 100 1000 10000 100000 1000000]
+
+For each size, fills a buffer, then times inserting into the full buffer,
+which evicts the worst item, and removing the best item:
+
+- minmax: min-max heap, O(log n) for both
+- heapq: binary heap with a linear scan for the worst item, O(n) eviction
+
+"""
+
+import argparse
+import heapq
+import random
+import time
+
+from buffer import MinMaxHeap
+
+# Priorities are 1 to 9, like chat messages; seq keeps them FIFO.
+PRIORITIES = range(1, 10)
+
+
+class HeapqBuffer:
+    def __init__(self):
+        self.items = []
+
+    def __len__(self):
+        return len(self.items)
+
+    def push(self, item):
+        heapq.heappush(self.items, item)
+
+    def pop_min(self):
+        return heapq.heappop(self.items)
+
+    def pop_max(self):
+        i = max(range(len(self.items)), key=self.items.__getitem__)
+        item = self.items[i]
+        self.items[i] = self.items[-1]
+        self.items.pop()
+        heapq.heapify(self.items)
+        return item
+
+
+def bench(cls, size, operations):
+    rng = random.Random(42)
+    buffer = cls()
+    for seq in range(size):
+        buffer.push((rng.choice(PRIORITIES), seq))
+
+    # Insert into a full buffer, evicting the worst item each time
+    start = time.perf_counter()
+    for seq in range(size, size + operations):
+        buffer.push((rng.choice(PRIORITIES), seq))
+        buffer.pop_max()
+    insert = (time.perf_counter() - start) / operations
+
+    start = time.perf_counter()
+    for _ in range(min(operations, size)):
+        buffer.pop_min()
+    remove = (time.perf_counter() - start) / min(operations, size)
+
+    return insert, remove
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+",
+                        default=[10, 100, 1_000, 10_000, 100_000, 1_000_000])
+    parser.add_argument("--operations", type=int, default=10_000)
+    args = parser.parse_args()
+
+    print(f"{'size':>10} {'buffer':>8} {'insert µs':>10} {'remove µs':>10}")
+    for size in args.sizes:
+        for cls, name in [(MinMaxHeap, "minmax"), (HeapqBuffer, "heapq")]:
+            # Linear eviction gets slow; keep each run to a few seconds
+            operations = args.operations
+            if cls is HeapqBuffer:
+                operations = max(10, min(operations, 10_000_000 // size))
+            insert, remove = bench(cls, size, operations)
+            print(f"{size:>10,} {name:>8} {insert * 1e6:>10.2f} {remove * 1e6:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
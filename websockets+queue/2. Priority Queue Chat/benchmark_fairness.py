@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+
+"""
+Show how well each scheduler isolates clients from a flooding client.
+
+    python benchmark_fairness.py [--clients 10] [--duration 5] [--rate 2000]
+
+Starts server.py with each scheduler and a limited total send rate, then
+measures round-trip latency for well-behaved clients sending one message
+every 20 ms, first alone, then while two clients with weights 1 and 3
+flood the server from other processes. With drr, latency stays flat and
+the flooding clients share what's left in proportion to their weights.
+
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import statistics
+import subprocess
+import sys
+import time
+
+import websockets
+
+URI = "ws://localhost:8765"
+
+# Seconds between messages of a well-behaved client.
+INTERVAL = 0.02
+
+# Messages per second sent by each flooding client, well above what the
+# server may send, but leaving some CPU for the server on small machines.
+FLOOD_RATE = 5000
+
+
+async def flood(weight, duration):
+    # Send in bursts of 100 messages, count what comes back
+    async with websockets.connect(f"{URI}/?weight={weight}") as websocket:
+        received = 0
+
+        async def receive():
+            nonlocal received
+            async for _ in websocket:
+                received += 1
+
+        task = asyncio.create_task(receive())
+        end = time.monotonic() + duration
+        while time.monotonic() < end:
+            for _ in range(100):
+                await websocket.send("5:" + "x" * 20)
+            await asyncio.sleep(100 / FLOOD_RATE)
+        task.cancel()
+        return received / duration
+
+
+def flood_process(weight, duration, results):
+    results.put((weight, asyncio.run(flood(weight, duration))))
+
+
+async def client(duration, latencies):
+    async with websockets.connect(URI) as websocket:
+        end = time.monotonic() + duration
+        while time.monotonic() < end:
+            start = time.perf_counter()
+            await websocket.send("1:ping")
+            await websocket.recv()
+            latencies.append(time.perf_counter() - start)
+            await asyncio.sleep(INTERVAL)
+
+
+async def measure(clients, duration):
+    latencies = []
+    await asyncio.gather(*(client(duration, latencies) for _ in range(clients)))
+    latencies.sort()
+    return (
+        statistics.median(latencies) * 1000,
+        latencies[int(len(latencies) * 0.99)] * 1000,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--clients", type=int, default=10)
+    parser.add_argument("--duration", type=float, default=5)
+    parser.add_argument("--rate", type=float, default=2000,
+                        help="messages per second the server sends in total")
+    parser.add_argument("--quantum", type=int, default=256,
+                        help="bytes per round for a client of weight 1")
+    parser.add_argument("--queue-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    print(f"{'scheduler':>9} {'flood':>6} {'p50 ms':>8} {'p99 ms':>8} {'w=1 msg/s':>10} {'w=3 msg/s':>10}")
+    for scheduler in ["drr", "fifo"]:
+        server = subprocess.Popen(
+            [sys.executable, "server.py", "--scheduler", scheduler,
+             "--rate", str(args.rate), "--quantum", str(args.quantum),
+             "--queue-size", str(args.queue_size)],
+            stdout=subprocess.DEVNULL,
+        )
+        try:
+            time.sleep(1)
+            for flooding in [False, True]:
+                results = multiprocessing.Queue()
+                floods = [
+                    multiprocessing.Process(target=flood_process, args=(weight, args.duration + 1, results))
+                    for weight in ([1, 3] if flooding else [])
+                ]
+                for process in floods:
+                    process.start()
+                if flooding:
+                    # Let the flooding clients fill their buffers
+                    time.sleep(0.5)
+                p50, p99 = asyncio.run(measure(args.clients, args.duration))
+                rates = dict(results.get() for _ in floods)
+                for process in floods:
+                    process.join()
+                print(
+                    f"{scheduler:>9} {'on' if flooding else 'off':>6} {p50:>8.1f} {p99:>8.1f}"
+                    f" {rates.get(1, 0):>10,.0f} {rates.get(3, 0):>10,.0f}"
+                )
+        finally:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == "__main__":
+    main()
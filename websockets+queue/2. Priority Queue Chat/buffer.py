@@ -0,0 +1,187 @@
+"""
+Bounded priority buffer for outgoing chat messages.
+
+Lower numbers mean higher priority. When the buffer is full, the message
+with the lowest priority is dropped, and messages with the same priority
+are delivered in the order they arrived.
+
+"""
+
+__all__ = ["MinMaxHeap", "PriorityBuffer"]
+
+import asyncio
+import itertools
+import operator
+import time
+
+
+class MinMaxHeap:
+    """
+    Double-ended priority queue.
+
+    Both the smallest and the largest item can be read in constant time and
+    removed in O(log n) time. Items must be comparable.
+
+    Levels of the tree alternate between min levels, where each item is
+    smaller than all its descendants, and max levels, where each item is
+    larger than all its descendants. The root is on a min level.
+
+    """
+
+    def __init__(self):
+        self.items = []
+
+    def __len__(self):
+        return len(self.items)
+
+    def min(self):
+        return self.items[0]
+
+    def max(self):
+        return self.items[self._max_index()]
+
+    def push(self, item):
+        items = self.items
+        items.append(item)
+        i = len(items) - 1
+        if i == 0:
+            return
+        parent = (i - 1) // 2
+        less = operator.lt if self._on_min_level(i) else operator.gt
+        # An item smaller than its max-level parent, or larger than its
+        # min-level parent, belongs to the other kind of level
+        if less(items[parent], items[i]):
+            items[i], items[parent] = items[parent], items[i]
+            self._bubble_up(parent, operator.gt if less is operator.lt else operator.lt)
+        else:
+            self._bubble_up(i, less)
+
+    def pop_min(self):
+        return self._pop(0)
+
+    def pop_max(self):
+        return self._pop(self._max_index())
+
+    @staticmethod
+    def _on_min_level(i):
+        # Level of index i is (i + 1).bit_length() - 1; even levels are min
+        return (i + 1).bit_length() % 2 == 1
+
+    def _max_index(self):
+        items = self.items
+        if len(items) <= 2:
+            return len(items) - 1
+        return 1 if items[1] >= items[2] else 2
+
+    def _pop(self, i):
+        items = self.items
+        last = items.pop()
+        if i == len(items):
+            return last
+        item, items[i] = items[i], last
+        self._trickle_down(i)
+        return item
+
+    def _bubble_up(self, i, less):
+        # Move up through grandparents, i.e. levels of the same kind
+        items = self.items
+        while i > 2:
+            grandparent = ((i - 1) // 2 - 1) // 2
+            if not less(items[i], items[grandparent]):
+                break
+            items[i], items[grandparent] = items[grandparent], items[i]
+            i = grandparent
+
+    def _trickle_down(self, i):
+        items = self.items
+        size = len(items)
+        less = operator.lt if self._on_min_level(i) else operator.gt
+        while True:
+            # Best of children and grandchildren
+            first_child = 2 * i + 1
+            if first_child >= size:
+                return
+            candidates = [first_child, first_child + 1]
+            candidates += range(4 * i + 3, min(4 * i + 7, size))
+            best = first_child
+            for j in candidates[1:]:
+                if j < size and less(items[j], items[best]):
+                    best = j
+
+            if not less(items[best], items[i]):
+                return
+            items[i], items[best] = items[best], items[i]
+            if best <= first_child + 1:
+                # A child is on the other kind of level; nothing below it
+                # can be out of order
+                return
+            parent = (best - 1) // 2
+            if less(items[parent], items[best]):
+                items[best], items[parent] = items[parent], items[best]
+            i = best
+
+
+class PriorityBuffer:
+    """
+    Bounded buffer delivering the highest priority message first.
+
+    :meth:`put_nowait` never blocks: when the buffer is full, the message
+    with the lowest priority, possibly the new one, is dropped and counted
+    in :attr:`dropped`. Messages with the same priority are delivered in
+    the order they arrived.
+
+    With ``aging`` set, waiting messages gain that many priority levels per
+    second, so a steady stream of urgent messages can't starve the others
+    forever. Aging is folded into the sort key when a message arrives:
+    comparing ``p1 - aging * (now - t1)`` with ``p2 - aging * (now - t2)``
+    gives the same result at any time ``now`` as comparing ``p1 + aging * t1``
+    with ``p2 + aging * t2``, so the heap never needs reordering.
+
+    """
+
+    def __init__(self, maxsize, aging=0):
+        self.maxsize = maxsize
+        self.aging = aging
+        self.heap = MinMaxHeap()
+        self.seq = itertools.count()
+        self.epoch = time.monotonic()
+        self.not_empty = asyncio.Event()
+        self.dropped = 0
+
+    def qsize(self):
+        return len(self.heap)
+
+    def empty(self):
+        return not self.heap
+
+    def full(self):
+        return len(self.heap) >= self.maxsize
+
+    def put_nowait(self, priority, message):
+        key = priority
+        if self.aging:
+            key += self.aging * (time.monotonic() - self.epoch)
+        # seq is unique, so messages themselves are never compared
+        self.heap.push((key, next(self.seq), priority, message))
+        if len(self.heap) > self.maxsize:
+            self.heap.pop_max()
+            self.dropped += 1
+        self.not_empty.set()
+
+    def peek_nowait(self):
+        if not self.heap:
+            raise asyncio.QueueEmpty
+        _, seq, priority, message = self.heap.min()
+        return priority, seq, message
+
+    def get_nowait(self):
+        if not self.heap:
+            raise asyncio.QueueEmpty
+        _, seq, priority, message = self.heap.pop_min()
+        return priority, seq, message
+
+    async def get(self):
+        while not self.heap:
+            self.not_empty.clear()
+            await self.not_empty.wait()
+        return self.get_nowait()
@@ -1,4 +1,5 @@
 import asyncio
+import json
 import websockets
 
 
@@ -20,7 +21,13 @@ async def chat():
         async def receiver():
             while True:
                 response = await websocket.recv()
-                print("Received:", response)
+                # Coalesced batches are JSON arrays; single messages
+                # always start with "[p="
+                if response.startswith('["'):
+                    for message in json.loads(response):
+                        print("Received:", message)
+                else:
+                    print("Received:", response)
 
         await asyncio.gather(sender(), receiver())
 
@@ -1,12 +1,201 @@
+import argparse
 import asyncio
+import collections
+import json
+import time
+import urllib.parse
 import websockets
-import itertools
 
+from buffer import PriorityBuffer
+from connections import ConnectionManager
 
-async def receive_messages(websocket, queue, seq_counter):
+# Outbound coalescing, disabled when the window is 0. Before each round of
+# the scheduler, wait this many seconds, then send each client's messages
+# for the round, up to a number of messages and bytes, as one JSON array.
+COALESCE_WINDOW = 0
+COALESCE_MESSAGES = 100
+COALESCE_BYTES = 64 * 1024
+
+# Messages buffered per connection; when full, the lowest priority is dropped.
+QUEUE_SIZE = 10
+
+# Priority levels gained per second of waiting, 0 to disable aging.
+AGING = 0
+
+# Outbound scheduling across clients. "drr" serves clients in turn with
+# deficit round robin: each turn allows QUANTUM bytes times the client's
+# weight, so a client flooding the server only delays its own messages.
+# "fifo" serves messages in arrival order across all clients.
+SCHEDULER = "drr"
+SCHEDULERS = ["drr", "fifo"]
+QUANTUM = 1024
+MAX_WEIGHT = 10
+
+# Messages per second sent in total, standing in for a shared downstream
+# resource with limited capacity; 0 for no limit.
+RATE = 0
+
+# Frames waiting for each client's writer. The scheduler skips clients
+# whose outbox is full, so a slow reader doesn't hold up the others.
+OUTBOX_SIZE = 32
+
+# Connection limits, heartbeats, idle timeouts and graceful shutdown.
+# Clients that only read answer pings, so they aren't idle.
+manager = ConnectionManager(ping_idle=True)
+
+# Clients currently connected.
+clients = set()
+
+
+class Client:
+    def __init__(self, websocket, weight):
+        self.websocket = websocket
+        self.weight = weight
+        self.buffer = PriorityBuffer(QUEUE_SIZE, AGING)
+        self.outbox = asyncio.Queue(OUTBOX_SIZE)
+        self.deficit = 0
+        self.active = False   # waiting for a turn in the scheduler
+        self.closed = False
+
+
+class Scheduler:
+    """
+    Server-wide scheduler for outbound messages.
+
+    Within a client, messages go out in priority order. Across clients,
+    they go out by deficit round robin or in arrival order, see SCHEDULER.
+
+    """
+
+    def __init__(self):
+        # drr: clients with messages waiting, in round order
+        # fifo: the client of each message waiting, in arrival order
+        self.queue = collections.deque()
+        self.wakeup = asyncio.Event()
+        self.next_send = 0
+
+    def enqueue(self, client, priority, message):
+        # Queue full → the lowest-priority item is dropped, maybe this one
+        dropped = client.buffer.dropped
+        client.buffer.put_nowait(priority, message)
+        if SCHEDULER == "fifo":
+            # One entry per buffered message: none when one was dropped
+            if client.buffer.dropped == dropped:
+                self.queue.append(client)
+        elif not client.active:
+            client.active = True
+            self.queue.append(client)
+        self.wakeup.set()
+
+    def wake(self):
+        # Called by writers when an outbox has room again
+        self.wakeup.set()
+
+    async def run(self):
+        while True:
+            self.wakeup.clear()
+            if COALESCE_WINDOW and self.queue:
+                # Let more messages arrive before the round
+                await asyncio.sleep(COALESCE_WINDOW)
+            if SCHEDULER == "fifo":
+                progress = await self.fifo_round()
+            else:
+                progress = await self.drr_round()
+            if progress:
+                # Let receivers and writers run between rounds
+                await asyncio.sleep(0)
+            else:
+                await self.wakeup.wait()
+
+    async def fifo_round(self):
+        progress = False
+        while self.queue:
+            client = self.queue[0]
+            if client.closed or client.buffer.empty():
+                # Client gone, or its message was dropped
+                self.queue.popleft()
+                continue
+            if client.outbox.full():
+                # Head-of-line blocking, the price of strict arrival order
+                break
+            self.queue.popleft()
+            priority, seq, message = client.buffer.get_nowait()
+            await self.pace()
+            client.outbox.put_nowait(f"[p={priority}] {message}")
+            progress = True
+        return progress
+
+    async def drr_round(self):
+        progress = False
+        for _ in range(len(self.queue)):
+            client = self.queue.popleft()
+            if client.closed:
+                client.active = False
+                continue
+            if not client.outbox.full():
+                # Even if the deficit is still too small for the next
+                # message, it grows each round until it's large enough
+                client.deficit += QUANTUM * client.weight
+                await self.drr_turn(client)
+                progress = True
+            if client.buffer.empty():
+                # Credit doesn't carry over idle periods
+                client.deficit = 0
+                client.active = False
+            else:
+                self.queue.append(client)
+        return progress
+
+    async def drr_turn(self, client):
+        # Send the client's best messages while its deficit allows
+        while not client.buffer.empty() and not client.outbox.full():
+            frame, size = [], 0
+            while not client.buffer.empty():
+                priority, seq, message = client.buffer.peek_nowait()
+                text = f"[p={priority}] {message}"
+                if len(text) > client.deficit:
+                    break
+                client.buffer.get_nowait()
+                client.deficit -= len(text)
+                frame.append(text)
+                size += len(text)
+                await self.pace()
+                if not COALESCE_WINDOW or len(frame) >= COALESCE_MESSAGES or size >= COALESCE_BYTES:
+                    break
+            if not frame:
+                break
+            client.outbox.put_nowait(frame[0] if len(frame) == 1 else json.dumps(frame))
+
+    async def pace(self):
+        # Space messages 1 / RATE seconds apart
+        if not RATE:
+            return
+        now = time.monotonic()
+        delay = self.next_send - now
+        self.next_send = max(self.next_send, now) + 1 / RATE
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+scheduler = Scheduler()
+
+
+def parse_weight(websocket):
+    # Weight from the connection URL, e.g. ws://localhost:8765/?weight=3.
+    # A real deployment would take it from the client's account instead.
+    query = urllib.parse.urlparse(websocket.request.path).query
+    try:
+        weight = int(urllib.parse.parse_qs(query).get("weight", ["1"])[0])
+    except ValueError:
+        weight = 1
+    return min(max(weight, 1), MAX_WEIGHT)
+
+
+async def receive_messages(client):
     try:
         while True:
-            data = await websocket.recv()
+            data = await client.websocket.recv()
+            manager.touch(client.websocket)
 
             # Format: "priority:message"
             try:
@@ -17,47 +206,41 @@ async def receive_messages(websocket, queue, seq_counter):
                 priority = 5
                 message = data
 
-            seq = next(seq_counter)
-
-            item = (priority, seq, message)
+            scheduler.enqueue(client, priority, message)
 
-            # Queue full → drop lowest-priority item
-            if queue.full():
-                dropped = queue.get_nowait()
-                queue.task_done()
+            # recv() doesn't yield while frames are buffered; without this,
+            # a flooding client would starve the scheduler and other clients
+            await asyncio.sleep(0)
 
-            await queue.put(item)
-
-    except asyncio.CancelledError:
+    except (asyncio.CancelledError, websockets.exceptions.ConnectionClosed):
         pass
 
 
-async def send_messages(websocket, queue):
+async def send_messages(client):
     try:
         while True:
-            priority, seq, message = await queue.get()
-            await websocket.send(f"[p={priority}] {message}")
-            queue.task_done()
-    except asyncio.CancelledError:
+            text = await client.outbox.get()
+            await client.websocket.send(text)
+            scheduler.wake()
+    except (asyncio.CancelledError, websockets.exceptions.ConnectionClosed):
         pass
 
 
 async def handler(websocket):
-    print("Client connected")
-
-    queue = asyncio.PriorityQueue(maxsize=10)
-    seq_counter = itertools.count()
+    client = Client(websocket, parse_weight(websocket))
+    clients.add(client)
+    print(f"Client connected, weight {client.weight}")
 
     recv_task = asyncio.create_task(
-        receive_messages(websocket, queue, seq_counter)
+        receive_messages(client)
     )
     send_task = asyncio.create_task(
-        send_messages(websocket, queue)
+        send_messages(client)
     )
 
     done, pending = await asyncio.wait(
         {recv_task, send_task},
-        return_when=asyncio.FIRST_EXCEPTION,
+        return_when=asyncio.FIRST_COMPLETED,
     )
 
     for task in pending:
@@ -65,13 +248,55 @@ async def handler(websocket):
 
     await asyncio.gather(*pending, return_exceptions=True)
 
-    print("Client disconnected")
+    client.closed = True
+    clients.discard(client)
+    print(f"Client disconnected, {client.buffer.dropped} messages dropped")
+
+
+async def drain():
+    # On shutdown, wait until connected clients got the messages buffered
+    # for them; the scheduler keeps running meanwhile
+    while any(not client.buffer.empty() or not client.outbox.empty() for client in clients):
+        await asyncio.sleep(0.01)
 
 
 async def main():
-    async with websockets.serve(handler, "localhost", 8765):
-        print("Server running on ws://localhost:8765")
-        await asyncio.Future()
+    scheduler_task = asyncio.create_task(scheduler.run())
+    async with websockets.serve(
+        manager.wrap(handler), "localhost", 8765, **manager.serve_options()
+    ) as server:
+        print(f"Server running on ws://localhost:8765 ({SCHEDULER} scheduler)")
+        # Until SIGTERM or Ctrl-C
+        await manager.run(server, drain=drain)
+    scheduler_task.cancel()
 
 
-asyncio.run(main())
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--coalesce", type=float, default=0, metavar="MS",
+                        help="coalescing window in milliseconds, 0 to disable")
+    parser.add_argument("--batch-messages", type=int, default=COALESCE_MESSAGES)
+    parser.add_argument("--batch-bytes", type=int, default=COALESCE_BYTES)
+    parser.add_argument("--queue-size", type=int, default=QUEUE_SIZE)
+    parser.add_argument("--aging", type=float, default=AGING,
+                        help="priority levels gained per second of waiting")
+    parser.add_argument("--scheduler", choices=SCHEDULERS, default=SCHEDULER)
+    parser.add_argument("--quantum", type=int, default=QUANTUM,
+                        help="bytes per round for a client of weight 1")
+    parser.add_argument("--rate", type=float, default=RATE,
+                        help="messages per second sent in total, 0 for no limit")
+    parser.add_argument("--max-connections", type=int, default=manager.max_connections)
+    parser.add_argument("--idle-timeout", type=float, default=manager.idle_timeout,
+                        help="seconds without messages or pongs before closing, 0 to disable")
+    parser.add_argument("--drain-timeout", type=float, default=manager.drain_timeout,
+                        help="seconds to send buffered messages on shutdown")
+    args = parser.parse_args()
+    manager = ConnectionManager(
+        args.max_connections, args.idle_timeout, args.drain_timeout, ping_idle=True
+    )
+    QUEUE_SIZE, AGING = args.queue_size, args.aging
+    SCHEDULER, QUANTUM, RATE = args.scheduler, args.quantum, args.rate
+    COALESCE_WINDOW = args.coalesce / 1000
+    COALESCE_MESSAGES, COALESCE_BYTES = args.batch_messages, args.batch_bytes
+
+    asyncio.run(main())
@@ -1,15 +1,58 @@
 #!/usr/bin/env python
 
+import argparse
 import asyncio
 import itertools
 import json
+import time
+from concurrent.futures import ProcessPoolExecutor
 
 from websockets.asyncio.server import serve
 
-from connect4 import PLAYER1, PLAYER2, Connect4
+from connections import ConnectionManager
+from connect4 import HEIGHT, PLAYER1, PLAYER2, WIDTH, Connect4
+from solver import best_move
 
 
-async def handler(websocket):
+# Connection limits, heartbeats, idle timeouts and graceful shutdown.
+MANAGER = ConnectionManager()
+
+# Time the computer may spend on a move, in seconds.
+THINK_TIME = 0.5
+
+# Worker processes running the search, so that it never blocks the event loop.
+# Each worker keeps its own transposition table across moves and games.
+EXECUTOR = ProcessPoolExecutor()
+
+
+async def error(websocket, message):
+    event = {
+        "type": "error",
+        "message": message,
+    }
+    await websocket.send(json.dumps(event))
+
+
+async def send_move(websocket, game, player, column, row):
+    # Send a "play" event to update the UI.
+    event = {
+        "type": "play",
+        "player": player,
+        "column": column,
+        "row": row,
+    }
+    await websocket.send(json.dumps(event))
+
+    # If move is winning, send a "win" event.
+    if game.winner is not None:
+        event = {
+            "type": "win",
+            "player": game.winner,
+        }
+        await websocket.send(json.dumps(event))
+
+
+async def play_humans(websocket):
     # Initialize a Connect Four game.
     game = Connect4()
 
@@ -18,6 +61,7 @@ async def handler(websocket):
     player = next(turns)
 
     async for message in websocket:
+        MANAGER.touch(websocket)
         # Parse a "play" event from the UI.
         event = json.loads(message)
         assert event["type"] == "play"
@@ -28,38 +72,76 @@ async def handler(websocket):
             row = game.play(player, column)
         except ValueError as exc:
             # Send an "error" event if the move was illegal.
-            event = {
-                "type": "error",
-                "message": str(exc),
-            }
-            await websocket.send(json.dumps(event))
+            await error(websocket, str(exc))
             continue
 
-        # Send a "play" event to update the UI.
-        event = {
-            "type": "play",
-            "player": player,
-            "column": column,
-            "row": row,
-        }
-        await websocket.send(json.dumps(event))
-
-        # If move is winning, send a "win" event.
-        if game.winner is not None:
-            event = {
-                "type": "win",
-                "player": game.winner,
-            }
-            await websocket.send(json.dumps(event))
+        await send_move(websocket, game, player, column, row)
 
         # Alternate turns.
         player = next(turns)
 
 
+async def play_computer(websocket):
+    # Initialize a Connect Four game. The human plays first.
+    game = Connect4()
+    loop = asyncio.get_running_loop()
+
+    async for message in websocket:
+        MANAGER.touch(websocket)
+        # Parse a "play" event from the UI.
+        event = json.loads(message)
+        assert event["type"] == "play"
+        column = event["column"]
+
+        try:
+            # Play the move.
+            row = game.play(PLAYER1, column)
+        except ValueError as exc:
+            # Send an "error" event if the move was illegal.
+            await error(websocket, str(exc))
+            continue
+
+        await send_move(websocket, game, PLAYER1, column, row)
+
+        if game.winner is not None or len(game.moves) == WIDTH * HEIGHT:
+            continue
+
+        # Search in a worker process. The deadline is set here, so time spent
+        # waiting for a free worker counts against the budget.
+        columns = [column for _, column, _ in game.moves]
+        deadline = time.monotonic() + THINK_TIME
+        column = await loop.run_in_executor(EXECUTOR, best_move, columns, deadline)
+
+        row = game.play(PLAYER2, column)
+        await send_move(websocket, game, PLAYER2, column, row)
+
+
+async def handler(websocket):
+    # Receive and parse the "init" event from the UI.
+    message = await websocket.recv()
+    event = json.loads(message)
+    assert event["type"] == "init"
+
+    if event.get("computer"):
+        # One player against the computer.
+        await play_computer(websocket)
+    else:
+        # Two players take turns in the same browser.
+        await play_humans(websocket)
+
+
 async def main():
-    async with serve(handler, "", 8001) as server:
-        await server.serve_forever()
+    async with serve(MANAGER.wrap(handler), "", 8001, **MANAGER.serve_options()) as server:
+        # Until SIGTERM or Ctrl-C
+        await MANAGER.run(server)
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--max-connections", type=int, default=MANAGER.max_connections)
+    parser.add_argument("--idle-timeout", type=float, default=MANAGER.idle_timeout,
+                        help="seconds without moves before closing, 0 to disable")
+    args = parser.parse_args()
+    MANAGER = ConnectionManager(args.max_connections, args.idle_timeout)
+
+    asyncio.run(main())
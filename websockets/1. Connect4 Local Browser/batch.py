@@ -0,0 +1,110 @@
+__all__ = ["PLAYERS", "BatchConnect4"]
+
+import numpy as np
+
+from connect4 import HEIGHT, PLAYER1, PLAYER2, WIDTH
+
+# Values of :attr:`BatchConnect4.winner`, indexed by winner code.
+PLAYERS = (None, PLAYER1, PLAYER2)
+
+
+class BatchConnect4:
+    """
+    Many Connect Four games played in lockstep.
+
+    Play one move in every game with :meth:`play`.
+
+    Check for victories with :attr:`winner`: 0 while the game is undecided,
+    1 if :data:`PLAYER1` won, 2 if :data:`PLAYER2` won.
+
+    Boards are stored like in :class:`Connect4`: one 64-bit bitmask per
+    player, with 8 bits per column, so win detection uses the same four
+    shift directions as :attr:`Connect4.last_player_won`.
+
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.boards = np.zeros((2, size), dtype=np.uint64)
+        self.top = np.zeros((size, WIDTH), dtype=np.int8)
+        self.plies = np.zeros(size, dtype=np.int16)
+        self.winner = np.zeros(size, dtype=np.int8)
+        self._index = np.arange(size)
+
+    @property
+    def done(self):
+        """
+        Whether each game is over, because it was won or the board is full.
+
+        """
+        return (self.winner != 0) | (self.plies == WIDTH * HEIGHT)
+
+    def legal_moves(self):
+        """
+        Array of shape ``(size, WIDTH)`` telling which columns can be played.
+
+        """
+        return (self.top < HEIGHT) & ~self.done[:, None]
+
+    def random_moves(self, rng):
+        """
+        Pick a random legal column in each game, or 0 if the game is over.
+
+        """
+        weights = rng.random((self.size, WIDTH)) * self.legal_moves()
+        return weights.argmax(axis=1)
+
+    @staticmethod
+    def _has_four(b):
+        # Vertical, diagonal, horizontal and anti-diagonal alignments.
+        found = np.zeros(b.shape, dtype=bool)
+        for v in [1, 7, 8, 9]:
+            v = np.uint64(v)
+            found |= (b & b >> v & b >> 2 * v & b >> 3 * v) != 0
+        return found
+
+    def play(self, columns):
+        """
+        Play one move in each game; ``columns`` has one column per game.
+
+        The player to move in each game plays. Moves in full columns, outside
+        the board or in finished games are ignored.
+
+        Returns three arrays: whether each move was legal, the row where each
+        checker landed (-1 for illegal moves) and the winner of each game.
+
+        """
+        columns = np.asarray(columns, dtype=np.int64)
+        index = self._index
+
+        in_board = (columns >= 0) & (columns < WIDTH)
+        columns = np.where(in_board, columns, 0)
+        rows = self.top[index, columns].astype(np.int64)
+        legal = in_board & (rows < HEIGHT) & ~self.done
+        rows = np.where(legal, rows, -1)
+
+        player = self.plies % 2
+        shift = np.where(legal, 8 * columns + rows, 0).astype(np.uint64)
+        bits = np.where(legal, np.uint64(1) << shift, np.uint64(0))
+        self.boards[player, index] |= bits
+        self.top[index[legal], columns[legal]] += 1
+        self.plies += legal
+
+        won = legal & self._has_four(self.boards[player, index])
+        self.winner[won] = player[won] + 1
+
+        return legal, rows, self.winner.copy()
+
+    def reset(self, games=None):
+        """
+        Start new games, in all boards or in those selected by ``games``.
+
+        ``games`` may be a boolean mask or an array of indices.
+
+        """
+        if games is None:
+            games = slice(None)
+        self.boards[:, games] = 0
+        self.top[games] = 0
+        self.plies[games] = 0
+        self.winner[games] = 0
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+
+"""
+Measure how many random Connect Four games per second each engine plays.
+
+    python benchmark.py [--seconds 2]
+
+"""
+
+import argparse
+import random
+import time
+
+import numpy as np
+
+from batch import BatchConnect4
+from connect4 import HEIGHT, PLAYER1, PLAYER2, WIDTH, Connect4
+
+BATCH_SIZES = [1, 10, 100, 1_000, 10_000, 100_000]
+
+
+def bench_single(seconds):
+    # Baseline: one Connect4 object, stepped one move at a time.
+    games = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        game = Connect4()
+        while game.winner is None and len(game.moves) < WIDTH * HEIGHT:
+            column = random.choice([c for c in range(WIDTH) if game.top[c] < HEIGHT])
+            game.play(PLAYER2 if len(game.moves) % 2 else PLAYER1, column)
+        games += 1
+    return games / (time.perf_counter() - start)
+
+
+def bench_batch(size, seconds):
+    rng = np.random.default_rng(0)
+    batch = BatchConnect4(size)
+    games = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        batch.reset()
+        # A game lasts at most WIDTH * HEIGHT moves.
+        for _ in range(WIDTH * HEIGHT):
+            batch.play(batch.random_moves(rng))
+            if batch.done.all():
+                break
+        games += size
+    return games / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--seconds", type=float, default=2.0)
+    args = parser.parse_args()
+
+    print(f"{'engine':>10} {'batch':>8} {'games/s':>12}")
+    print(f"{'Connect4':>10} {1:>8} {bench_single(args.seconds):>12,.0f}")
+    for size in BATCH_SIZES:
+        rate = bench_batch(size, args.seconds)
+        print(f"{'batch':>10} {size:>8,} {rate:>12,.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -26,6 +26,19 @@ function receiveMoves(board, websocket) {
   });
 }
 
+function initGame(websocket) {
+  websocket.addEventListener("open", () => {
+    // Send an "init" event according to the selected game mode.
+    const params = new URLSearchParams(window.location.search);
+    const event = { type: "init" };
+    if (params.has("computer")) {
+      // One player against the computer.
+      event.computer = true;
+    }
+    websocket.send(JSON.stringify(event));
+  });
+}
+
 function sendMoves(board, websocket) {
   // When clicking a column, send a "play" event for a move in that column.
   board.addEventListener("click", ({ target }) => {
@@ -48,6 +61,7 @@ window.addEventListener("DOMContentLoaded", () => {
   createBoard(board);
   // Open the WebSocket connection and register event handlers.
   const websocket = new WebSocket("ws://localhost:8001/");
+  initGame(websocket);
   receiveMoves(board, websocket);
   sendMoves(board, websocket);
 });
\ No newline at end of file
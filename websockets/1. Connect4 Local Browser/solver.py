@@ -0,0 +1,261 @@
+__all__ = ["Solver", "best_move"]
+
+import collections
+import math
+import time
+
+from connect4 import HEIGHT, PLAYER1, PLAYER2, WIDTH, Connect4
+
+# Explore central columns first: they take part in more alignments, so they
+# produce alpha-beta cutoffs earlier.
+ORDER = sorted(range(WIDTH), key=lambda column: abs(column - WIDTH // 2))
+
+# Bits of the cells in the bottom row and of all cells of the board, in the
+# layout of :class:`Connect4` bitboards (8 bits per column).
+BOTTOM = sum(1 << (8 * column) for column in range(WIDTH))
+BOARD = BOTTOM * ((1 << HEIGHT) - 1)
+
+# Scores are from the point of view of the player to move. A win is worth
+# more than any heuristic score, and winning sooner is worth more.
+WIN = 1000
+
+# Default number of entries in the transposition table.
+TABLE_SIZE = 1 << 20
+
+# Kinds of scores stored in the transposition table.
+EXACT, LOWER, UPPER = 0, 1, 2
+
+
+class _Timeout(Exception):
+    pass
+
+
+def winning_cells(board, mask):
+    """
+    Empty cells that would complete an alignment of four for ``board``.
+
+    """
+    # Vertical: three checkers right below.
+    cells = (board << 1) & (board << 2) & (board << 3)
+    # Horizontal and both diagonals: a cell is winning if it fills the gap
+    # or extends the end of three checkers along the direction.
+    for v in [7, 8, 9]:
+        pair = (board << v) & (board << 2 * v)
+        cells |= pair & (board << 3 * v)
+        cells |= pair & (board >> v)
+        pair = (board >> v) & (board >> 2 * v)
+        cells |= pair & (board << v)
+        cells |= pair & (board >> 3 * v)
+    return cells & (BOARD ^ mask)
+
+
+def popcount(x):
+    return bin(x).count("1")
+
+
+class Solver:
+    """
+    Negamax search with alpha-beta pruning for :class:`Connect4` games.
+
+    Find a move with :meth:`search`. It deepens the search one ply at a time
+    until the deadline and returns the best move of the deepest completed
+    iteration.
+
+    Positions are cached in a transposition table bounded to ``table_size``
+    entries. It's kept across searches, so one solver should be reused for
+    the successive moves of a game, or for many games.
+
+    """
+
+    def __init__(self, table_size=TABLE_SIZE):
+        self.table = collections.OrderedDict()
+        self.table_size = table_size
+        self.nodes = 0
+        self.deadline = None
+
+    def store(self, key, entry):
+        table = self.table
+        if key not in table and len(table) >= self.table_size:
+            # Evict the oldest entry. Unlike a dict, deleting from the front
+            # of an OrderedDict doesn't slow down later iterations.
+            table.popitem(last=False)
+        table[key] = entry
+
+    def ordered(self, game, first):
+        """
+        Legal columns, starting with ``first`` then from the center outwards.
+
+        """
+        columns = [column for column in ORDER if game.top[column] < HEIGHT]
+        if first in columns:
+            columns.remove(first)
+            columns.insert(0, first)
+        return columns
+
+    def evaluate(self, game):
+        """
+        Heuristic score of a position where nobody can win immediately.
+
+        """
+        ply = len(game.moves)
+        current, opponent = game.boards[ply % 2], game.boards[1 - ply % 2]
+        mask = current | opponent
+        return popcount(winning_cells(current, mask)) - popcount(
+            winning_cells(opponent, mask)
+        )
+
+    def negamax(self, game, depth, alpha, beta):
+        """
+        Score of the position for the player to move, searching ``depth`` plies.
+
+        """
+        self.nodes += 1
+        if self.nodes & 1023 == 0 and time.monotonic() > self.deadline:
+            raise _Timeout
+
+        ply = len(game.moves)
+        if ply == WIDTH * HEIGHT:
+            return 0
+
+        current, opponent = game.boards[ply % 2], game.boards[1 - ply % 2]
+        mask = current | opponent
+        playable = (mask + BOTTOM) & BOARD
+
+        # Win immediately if possible.
+        if winning_cells(current, mask) & playable:
+            return WIN - ply
+
+        # Block the opponent if they threaten to win; two threats can't be
+        # blocked, so the position is lost.
+        threats = winning_cells(opponent, mask) & playable
+        if threats & (threats - 1):
+            return -(WIN - ply - 1)
+
+        if depth == 0:
+            return self.evaluate(game)
+
+        key = game.key
+        entry = self.table.get(key)
+        first = None
+        if entry is not None:
+            entry_depth, kind, score, first = entry
+            if entry_depth >= depth:
+                if kind == EXACT:
+                    return score
+                if kind == LOWER:
+                    alpha = max(alpha, score)
+                else:
+                    beta = min(beta, score)
+                if alpha >= beta:
+                    return score
+
+        if threats:
+            columns = [(threats.bit_length() - 1) // 8]
+        else:
+            columns = self.ordered(game, first)
+
+        player = PLAYER2 if ply % 2 else PLAYER1
+        original_alpha = alpha
+        best, best_column = -WIN, columns[0]
+        for column in columns:
+            game.play(player, column)
+            score = -self.negamax(game, depth - 1, -beta, -alpha)
+            game.undo()
+            if score > best:
+                best, best_column = score, column
+                if score > alpha:
+                    alpha = score
+                    if alpha >= beta:
+                        break
+
+        if best <= original_alpha:
+            kind = UPPER
+        elif best >= beta:
+            kind = LOWER
+        else:
+            kind = EXACT
+        self.store(key, (depth, kind, best, best_column))
+        return best
+
+    def root(self, game, depth):
+        """
+        Best score and column for the player to move, searching ``depth`` plies.
+
+        """
+        ply = len(game.moves)
+        player = PLAYER2 if ply % 2 else PLAYER1
+        entry = self.table.get(game.key)
+        alpha, beta = -WIN - 1, WIN + 1
+        best_column = None
+        for column in self.ordered(game, None if entry is None else entry[3]):
+            game.play(player, column)
+            if game.last_player_won:
+                score = WIN - ply
+            else:
+                score = -self.negamax(game, depth - 1, -beta, -alpha)
+            game.undo()
+            if score > alpha:
+                alpha, best_column = score, column
+        self.store(game.key, (depth, EXACT, alpha, best_column))
+        return alpha, best_column
+
+    def solve(self, game, depth):
+        """
+        Score of the position for the player to move, searching ``depth`` plies.
+
+        Unlike :meth:`search`, this runs without a deadline.
+
+        """
+        self.deadline = math.inf
+        self.nodes = 0
+        return self.negamax(game, depth, -WIN - 1, WIN + 1)
+
+    def search(self, game, deadline):
+        """
+        Pick a column for the player to move in ``game``.
+
+        ``deadline`` is a :func:`time.monotonic` timestamp. The search stops
+        when it's reached, except for the first iteration, which always
+        completes.
+
+        Returns :obj:`None` if the board is full.
+
+        """
+        self.deadline = deadline
+        self.nodes = 0
+        ply = len(game.moves)
+        best_column = None
+        for depth in range(1, WIDTH * HEIGHT - ply + 1):
+            try:
+                score, column = self.root(game, depth)
+            except _Timeout:
+                # Take back the moves of the interrupted iteration.
+                while len(game.moves) > ply:
+                    game.undo()
+                break
+            best_column = column
+            # Stop once the outcome of the game is known.
+            if abs(score) > WIN - WIDTH * HEIGHT - 1:
+                break
+        return best_column
+
+
+_solver = None
+
+
+def best_move(columns, deadline):
+    """
+    Pick a column for the player to move after playing ``columns``.
+
+    This is meant to run in a worker process. Each process keeps its own
+    solver, so the transposition table is reused across moves and games.
+
+    """
+    global _solver
+    if _solver is None:
+        _solver = Solver()
+
+    game = Connect4()
+    for ply, column in enumerate(columns):
+        game.play(PLAYER2 if ply % 2 else PLAYER1, column)
+    return _solver.search(game, deadline)
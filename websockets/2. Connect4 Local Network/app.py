@@ -1,19 +1,165 @@
 #!/usr/bin/env python
 
+import argparse
 import asyncio
-import itertools
-import json
+import multiprocessing
+import os
+import secrets
+import signal
+import tempfile
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
 
-from websockets.asyncio.server import serve
+from websockets.asyncio.client import unix_connect
+from websockets.asyncio.server import serve, unix_serve
+from websockets.exceptions import ConnectionClosed
 
-from connect4 import PLAYER1, PLAYER2, Connect4
+import protocol
 
+from book import OpeningBook
+from connections import ConnectionManager
+from connect4 import HEIGHT, PLAYER1, PLAYER2, WIDTH, Connect4
+from solver import best_move
 
-import secrets
 
+PORT = 8001
 
 JOIN = {}
 
+WATCH = {}
+
+# Connection limits, heartbeats, idle timeouts and graceful shutdown.
+MANAGER = ConnectionManager()
+
+# With several worker processes, each worker owns the games whose keys hash
+# to its index. Set by run_worker(); a single process owns every game.
+SHARD, SHARDS = 0, 1
+
+# Opening book built offline with `python book.py book.bin`. It's optional;
+# without it, hints are only available from the search.
+BOOK_PATH = os.path.join(os.path.dirname(__file__), "book.bin")
+BOOK = OpeningBook(BOOK_PATH) if os.path.exists(BOOK_PATH) else None
+
+# Time the computer may spend on a move once out of book, in seconds.
+THINK_TIME = 0.5
+
+# Worker processes running the search, so that it never blocks the event loop.
+# Created by main(), in each worker process after the fork, so the cores are
+# shared between workers rather than each one starting a pool of its own.
+EXECUTOR = None
+
+
+def owner(key):
+    # Index of the worker that owns the game with this join or watch key.
+    return zlib.crc32(key.encode()) % SHARDS
+
+
+def new_key():
+    # Draw keys until one hashes to this worker, so that connections using
+    # it later are routed here.
+    while True:
+        key = secrets.token_urlsafe(12)
+        if owner(key) == SHARD:
+            return key
+
+
+def socket_path(shard):
+    # Unix socket where a worker accepts connections forwarded by others.
+    return os.path.join(tempfile.gettempdir(), f"connect4-{PORT}-{shard}.sock")
+
+
+async def error(websocket, message):
+    event = {
+        "type": "error",
+        "message": message,
+    }
+    await protocol.send(websocket, event)
+
+
+async def hint(websocket, game):
+    # Look up the position in the opening book; this takes microseconds.
+    column = BOOK.hint(game) if BOOK is not None else None
+    if column is None:
+        await error(websocket, "No hint available for this position.")
+        return
+    event = {
+        "type": "hint",
+        "column": column,
+    }
+    await protocol.send(websocket, event)
+
+
+def send_move(connected, game, player, column, row):
+    # Send a "play" event to update the UI. Events are encoded once per
+    # format, JSON or binary, and broadcast without waiting, so a slow
+    # spectator never delays players.
+    event = {
+        "type": "play",
+        "player": player,
+        "column": column,
+        "row": row,
+    }
+    protocol.broadcast(connected, event)
+    # A move keeps everyone in the game active, including spectators.
+    for websocket in connected:
+        MANAGER.touch(websocket)
+
+    # If move is winning, send a "win" event.
+    if game.winner is not None:
+        event = {
+            "type": "win",
+            "player": game.winner,
+        }
+        protocol.broadcast(connected, event)
+
+
+async def replay(websocket, game):
+    # Send past moves in a single event. Players alternate and checkers stack
+    # up, so the list of columns is enough to rebuild the board.
+    event = {
+        "type": "replay",
+        "columns": [column for _, column, _ in game.moves],
+    }
+    await protocol.send(websocket, event)
+
+    if game.winner is not None:
+        event = {
+            "type": "win",
+            "player": game.winner,
+        }
+        await protocol.send(websocket, event)
+
+
+async def play(websocket, game, player, connected):
+    # Receive and process moves from a player.
+    async for message in websocket:
+        MANAGER.touch(websocket)
+        # Parse a "play" or "hint" event from the UI.
+        try:
+            event = protocol.decode(message)
+        except ValueError as exc:
+            # Send an "error" event if the message was malformed.
+            await error(websocket, str(exc))
+            continue
+        if event["type"] == "hint":
+            await hint(websocket, game)
+            continue
+        if event["type"] != "play":
+            await error(websocket, "Unexpected event.")
+            continue
+        column = event["column"]
+
+        try:
+            # Play the move.
+            row = game.play(player, column)
+        except ValueError as exc:
+            # Send an "error" event if the move was illegal.
+            await error(websocket, str(exc))
+            continue
+
+        send_move(connected, game, player, column, row)
+
 
 async def start(websocket):
     # Initialize a Connect Four game, the set of WebSocket connections
@@ -21,33 +167,28 @@ async def start(websocket):
     game = Connect4()
     connected = {websocket}
 
-    join_key = secrets.token_urlsafe(12)
+    join_key = new_key()
     JOIN[join_key] = game, connected
 
+    watch_key = new_key()
+    WATCH[watch_key] = game, connected
+
     try:
-        # Send the secret access token to the browser of the first player,
-        # where it'll be used for building a "join" link.
+        # Send the secret access tokens to the browser of the first player,
+        # where they'll be used for building "join" and "watch" links.
         event = {
             "type": "init",
             "join": join_key,
+            "watch": watch_key,
         }
-        await websocket.send(json.dumps(event))
+        await protocol.send(websocket, event)
 
-        # Temporary - for testing.
-        print("first player started game", id(game))
-        async for message in websocket:
-            print("first player sent", message)
+        # Receive and process moves from the first player.
+        await play(websocket, game, PLAYER1, connected)
 
     finally:
         del JOIN[join_key]
-
-
-async def error(websocket, message):
-    event = {
-        "type": "error",
-        "message": message,
-    }
-    await websocket.send(json.dumps(event))
+        del WATCH[watch_key]
 
 
 async def join(websocket, join_key):
@@ -61,34 +202,232 @@ async def join(websocket, join_key):
     # Register to receive moves from this game.
     connected.add(websocket)
     try:
+        # Receive and process moves from the second player.
+        await play(websocket, game, PLAYER2, connected)
 
-        # Temporary - for testing.
-        print("second player joined game", id(game))
-        async for message in websocket:
-            print("second player sent", message)
+    finally:
+        connected.remove(websocket)
 
+
+async def watch(websocket, watch_key):
+    # Find the Connect Four game.
+    try:
+        game, connected = WATCH[watch_key]
+    except KeyError:
+        await error(websocket, "Game not found.")
+        return
+
+    # Register to receive moves from this game, then catch up with it.
+    # The replay is queued before yielding to the event loop, so no move is
+    # missed or received twice.
+    connected.add(websocket)
+    try:
+        await replay(websocket, game)
+
+        # Spectators don't play; wait until they leave.
+        await websocket.wait_closed()
     finally:
         connected.remove(websocket)
 
 
+async def forward(websocket, message, shard):
+    # Relay the connection to the worker that owns the game, starting with
+    # the "init" event already received, until either side disconnects.
+    # Negotiate the same format upstream, so messages pass through as is.
+    subprotocols = [websocket.subprotocol] if websocket.subprotocol else None
+    async with unix_connect(socket_path(shard), subprotocols=subprotocols) as upstream:
+        await upstream.send(message)
+
+        async def relay(source, target):
+            async for message in source:
+                MANAGER.touch(websocket)
+                await target.send(message)
+
+        tasks = {
+            asyncio.create_task(relay(websocket, upstream)),
+            asyncio.create_task(relay(upstream, websocket)),
+        }
+        done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        for task in done:
+            try:
+                task.result()
+            except ConnectionClosed:
+                # Either side went away: the relay is over.
+                pass
+        # Other errors propagate, and the server closes the connection.
+
+
+async def computer_move(game):
+    # Early in the game, play from the opening book.
+    column = BOOK.hint(game) if BOOK is not None else None
+    if column is not None:
+        return column
+
+    # Otherwise, search in a worker process. The deadline is set here, so
+    # time spent waiting for a free worker counts against the budget.
+    loop = asyncio.get_running_loop()
+    columns = [column for _, column, _ in game.moves]
+    deadline = time.monotonic() + THINK_TIME
+    return await loop.run_in_executor(EXECUTOR, best_move, columns, deadline)
+
+
+async def play_computer(websocket):
+    # Initialize a Connect Four game. The human plays first.
+    game = Connect4()
+    connected = {websocket}
+
+    async for message in websocket:
+        MANAGER.touch(websocket)
+        # Parse a "play" or "hint" event from the UI.
+        try:
+            event = protocol.decode(message)
+        except ValueError as exc:
+            # Send an "error" event if the message was malformed.
+            await error(websocket, str(exc))
+            continue
+        if event["type"] == "hint":
+            await hint(websocket, game)
+            continue
+        if event["type"] != "play":
+            await error(websocket, "Unexpected event.")
+            continue
+        column = event["column"]
+
+        try:
+            # Play the move.
+            row = game.play(PLAYER1, column)
+        except ValueError as exc:
+            # Send an "error" event if the move was illegal.
+            await error(websocket, str(exc))
+            continue
+
+        send_move(connected, game, PLAYER1, column, row)
+
+        if game.winner is not None or len(game.moves) == WIDTH * HEIGHT:
+            continue
+
+        column = await computer_move(game)
+        row = game.play(PLAYER2, column)
+        send_move(connected, game, PLAYER2, column, row)
+
+
 async def handler(websocket):
     # Receive and parse the "init" event from the UI.
     message = await websocket.recv()
-    event = json.loads(message)
-    assert event["type"] == "init"
+    try:
+        event = protocol.decode(message)
+    except ValueError as exc:
+        await error(websocket, str(exc))
+        return
+    if event["type"] != "init":
+        await error(websocket, "Expected an init event.")
+        return
+
+    # Hand over connections to games owned by another worker.
+    key = event.get("join", event.get("watch"))
+    if key is not None and owner(key) != SHARD:
+        await forward(websocket, message, owner(key))
+        return
 
     if "join" in event:
         # Second player joins an existing game.
         await join(websocket, event["join"])
+    elif "watch" in event:
+        # Spectator watches an existing game.
+        await watch(websocket, event["watch"])
+    elif event.get("computer"):
+        # One player against the computer.
+        await play_computer(websocket)
     else:
         # First player starts a new game.
         await start(websocket)
 
 
+def process_request(connection, request):
+    protocol.skip_compression(request)
+    return MANAGER.process_request(connection, request)
+
+
 async def main():
-    async with serve(handler, "", 8001) as server:
-        await server.serve_forever()
+    global EXECUTOR
+    EXECUTOR = ProcessPoolExecutor(max(1, os.cpu_count() // SHARDS))
+    try:
+        await serve_forever()
+    finally:
+        # Wait for searches in progress without blocking the event loop.
+        await asyncio.get_running_loop().run_in_executor(None, EXECUTOR.shutdown)
+
+
+async def serve_forever():
+    handle = MANAGER.wrap(handler)
+    # Clients may negotiate binary events; the others get JSON.
+    options = dict(
+        MANAGER.serve_options(),
+        process_request=process_request,
+        select_subprotocol=protocol.select_subprotocol,
+    )
+    if SHARDS == 1:
+        async with serve(handle, "", PORT, **options) as server:
+            # Until SIGTERM or Ctrl-C
+            await MANAGER.run(server)
+        return
+
+    # Workers share the port; the kernel spreads new connections over them.
+    # Each worker also listens on a Unix socket for forwarded connections.
+    path = socket_path(SHARD)
+    if os.path.exists(path):
+        os.remove(path)
+    async with serve(handle, "", PORT, reuse_port=True, **options) as server:
+        async with unix_serve(handle, path, **options) as unix_server:
+            await MANAGER.run(server, unix_server)
+
+
+def run_worker(shard, shards, max_connections, idle_timeout):
+    # Settings are passed explicitly rather than set as globals by the parent:
+    # with the spawn or forkserver start methods, workers import this module
+    # afresh and wouldn't see them.
+    global MANAGER, SHARD, SHARDS
+    MANAGER = ConnectionManager(max_connections, idle_timeout)
+    SHARD, SHARDS = shard, shards
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=1, help="number of worker processes")
+    parser.add_argument("--max-connections", type=int, default=MANAGER.max_connections,
+                        help="per worker process")
+    parser.add_argument("--idle-timeout", type=float, default=MANAGER.idle_timeout,
+                        help="seconds without moves before closing, 0 to disable")
+    args = parser.parse_args()
+
+    if args.workers == 1:
+        run_worker(0, 1, args.max_connections, args.idle_timeout)
+    else:
+        workers = [
+            multiprocessing.Process(
+                target=run_worker,
+                args=(shard, args.workers, args.max_connections, args.idle_timeout),
+            )
+            for shard in range(args.workers)
+        ]
+        for worker in workers:
+            worker.start()
+        # Pass SIGTERM on to workers, which shut down gracefully.
+        signal.signal(
+            signal.SIGTERM,
+            lambda signum, frame: [worker.terminate() for worker in workers],
+        )
+        try:
+            for worker in workers:
+                worker.join()
+        except KeyboardInterrupt:
+            # Ctrl-C reaches workers too; wait for them to exit.
+            for worker in workers:
+                worker.join()
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+
+"""
+Compare JSON and binary events: server CPU time and bytes per move.
+
+    python benchmark_protocol.py [--games 20] [--spectators 10] [--moves 2000]
+
+Starts app.py, then plays games with random moves, two players and a few
+spectators per game, first with JSON clients, then with clients negotiating
+the binary subprotocol. Server CPU time and bytes on the loopback interface
+come from /proc (Linux). Also times encoding and decoding alone.
+
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+import timeit
+
+import websockets
+
+import protocol
+from connect4 import HEIGHT, PLAYER1, PLAYER2, WIDTH, Connect4
+
+URI = "ws://localhost:8001"
+
+
+def usage(pid):
+    # CPU seconds used by the server so far, and bytes sent on the loopback
+    # interface, which carries all traffic between clients and server
+    with open(f"/proc/{pid}/stat") as file:
+        fields = file.read().rpartition(")")[2].split()
+    cpu = (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    with open("/proc/net/dev") as file:
+        for line in file:
+            interface, _, counters = line.partition(":")
+            if interface.strip() == "lo":
+                sent = int(counters.split()[8])
+    return cpu, sent
+
+
+async def connect(binary, event):
+    websocket = await websockets.connect(
+        URI, subprotocols=[protocol.SUBPROTOCOL] if binary else None
+    )
+    await websocket.send(json.dumps(event))
+    return websocket
+
+
+async def watch(websocket):
+    async for _ in websocket:
+        pass
+
+
+async def setup(binary, spectators):
+    # Start a game with two players and spectators
+    player1 = await connect(binary, {"type": "init"})
+    init = json.loads(await player1.recv())
+    player2 = await connect(binary, {"type": "init", "join": init["join"]})
+    watchers = [
+        await connect(binary, {"type": "init", "watch": init["watch"]})
+        for _ in range(spectators)
+    ]
+    # Wait until every spectator got the (empty) replay
+    for websocket in watchers:
+        await websocket.recv()
+    return [player1, player2], watchers
+
+
+async def play(binary, players):
+    # Play random moves until the game ends, return the number of moves
+    board = Connect4()
+    while board.winner is None and len(board.moves) < WIDTH * HEIGHT:
+        column = random.choice([c for c in range(WIDTH) if board.top[c] < HEIGHT])
+        turn = len(board.moves) % 2
+        if binary:
+            await players[turn].send(bytes([protocol.PLAY, column]))
+        else:
+            await players[turn].send(json.dumps({"type": "play", "column": column}))
+        board.play([PLAYER1, PLAYER2][turn], column)
+        # Both players receive the move, and the win if it ends the game
+        for websocket in players:
+            for _ in range(1 if board.winner is None else 2):
+                await websocket.recv()
+    return len(board.moves)
+
+
+async def run(binary, games, spectators, moves, pid):
+    # Rounds of games played at once; only moves are measured, not the
+    # opening and closing handshakes
+    played, cpu, sent = 0, 0, 0
+    while played < moves:
+        games_ = await asyncio.gather(*[setup(binary, spectators) for _ in range(games)])
+        tasks = [
+            asyncio.create_task(watch(websocket))
+            for _, watchers in games_ for websocket in watchers
+        ]
+        start_cpu, start_sent = usage(pid)
+        played += sum(await asyncio.gather(*[play(binary, players) for players, _ in games_]))
+        end_cpu, end_sent = usage(pid)
+        cpu += end_cpu - start_cpu
+        sent += end_sent - start_sent
+        for players, watchers in games_:
+            for websocket in [*players, *watchers]:
+                await websocket.close()
+        await asyncio.gather(*tasks)
+    return played, cpu, sent
+
+
+def micro():
+    # Encoding a move, and decoding it on the client side
+    event = {"type": "play", "player": "red", "column": 3, "row": 2}
+    text, record = protocol.encode(event, False), protocol.encode(event, True)
+    number = 100_000
+    return {
+        "json": (
+            timeit.timeit(lambda: protocol.encode(event, False), number=number) / number,
+            timeit.timeit(lambda: json.loads(text), number=number) / number,
+            len(text),
+        ),
+        "binary": (
+            timeit.timeit(lambda: protocol.encode(event, True), number=number) / number,
+            timeit.timeit(lambda: protocol.RECORDS[protocol.PLAY].unpack(record), number=number) / number,
+            len(record),
+        ),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--games", type=int, default=20, help="games played at once")
+    parser.add_argument("--spectators", type=int, default=10, help="spectators per game")
+    parser.add_argument("--moves", type=int, default=2000, help="moves in total")
+    args = parser.parse_args()
+
+    print(f"{'format':>7} {'encode µs':>10} {'decode µs':>10} {'move bytes':>11}")
+    for name, (encode, decode, size) in micro().items():
+        print(f"{name:>7} {encode * 1e6:>10.2f} {decode * 1e6:>10.2f} {size:>11}")
+    print()
+
+    server = subprocess.Popen([sys.executable, "app.py"], stdout=subprocess.DEVNULL)
+    try:
+        time.sleep(1)
+        print(f"{'format':>7} {'moves':>7} {'cpu µs/move':>12} {'wire bytes/move':>16}")
+        for name, binary in [("json", False), ("binary", True)]:
+            played, cpu, sent = asyncio.run(
+                run(binary, args.games, args.spectators, args.moves, server.pid)
+            )
+            print(f"{name:>7} {played:>7} {cpu / played * 1e6:>12.0f} {sent / played:>16.0f}")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == "__main__":
+    main()
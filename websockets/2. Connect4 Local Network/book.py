@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+
+"""
+Build an opening book of Connect Four positions.
+
+    python book.py [--plies 6] [--depth 6] book.bin
+
+"""
+
+__all__ = ["OpeningBook", "build"]
+
+import argparse
+import mmap
+import struct
+import time
+
+from connect4 import HEIGHT, PLAYER1, PLAYER2, WIDTH, Connect4
+from solver import ORDER, Solver
+
+# One record per position: key, then score for the player to move.
+# Records are sorted by key, so lookups are a binary search.
+RECORD = struct.Struct("<Qh")
+
+
+class OpeningBook:
+    """
+    Read-only view of an opening book file.
+
+    The file is memory-mapped: opening it doesn't parse anything, and worker
+    processes reading the same file share its pages through the OS cache.
+
+    Look up scores with :meth:`score` and moves with :meth:`hint`.
+
+    """
+
+    def __init__(self, path):
+        with open(path, "rb") as file:
+            size = file.seek(0, 2)
+            # mmap can't map an empty file.
+            self.data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+        self.count = size // RECORD.size
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+
+    def score(self, key):
+        """
+        Score of the position with this key, or :obj:`None` if it isn't in the book.
+
+        """
+        data, size = self.data, RECORD.size
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            mid_key, score = RECORD.unpack_from(data, mid * size)
+            if mid_key < key:
+                lo = mid + 1
+            elif mid_key > key:
+                hi = mid
+            else:
+                return score
+        return None
+
+    def hint(self, game):
+        """
+        Best column for the player to move, or :obj:`None` if out of book.
+
+        """
+        player = PLAYER2 if len(game.moves) % 2 else PLAYER1
+        best_column, best_score = None, None
+        for column in ORDER:
+            if game.top[column] == HEIGHT:
+                continue
+            game.play(player, column)
+            try:
+                if game.last_player_won:
+                    return column
+                score = self.score(game.key)
+            finally:
+                game.undo()
+            if score is None:
+                # Every child must be in the book for a reliable answer.
+                return None
+            # Scores are from the point of view of the opponent.
+            if best_score is None or -score > best_score:
+                best_column, best_score = column, -score
+        return best_column
+
+
+def build(path, plies, depth):
+    """
+    Score every position reached in up to ``plies`` moves and write the book.
+
+    Each position is scored with a search of ``depth`` plies. Positions where
+    the game is already won aren't stored.
+
+    Returns the number of positions written.
+
+    """
+    solver = Solver()
+    scores = {}
+    game = Connect4()
+
+    def explore():
+        key = game.key
+        if key in scores:
+            return
+        scores[key] = solver.solve(game, depth)
+        if len(game.moves) == plies:
+            return
+        player = PLAYER2 if len(game.moves) % 2 else PLAYER1
+        for column in range(WIDTH):
+            if game.top[column] == HEIGHT:
+                continue
+            game.play(player, column)
+            if not game.last_player_won:
+                explore()
+            game.undo()
+
+    explore()
+
+    with open(path, "wb") as file:
+        for key in sorted(scores):
+            file.write(RECORD.pack(key, scores[key]))
+    return len(scores)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("path")
+    parser.add_argument("--plies", type=int, default=6, help="deepest position stored")
+    parser.add_argument("--depth", type=int, default=6, help="search depth per position")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    count = build(args.path, args.plies, args.depth)
+    elapsed = time.perf_counter() - start
+    print(f"Wrote {count:,} positions to {args.path} in {elapsed:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
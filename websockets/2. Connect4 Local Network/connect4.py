@@ -2,23 +2,35 @@ __all__ = ["PLAYER1", "PLAYER2", "Connect4"]
 
 PLAYER1, PLAYER2 = "red", "yellow"
 
+# Board geometry. Each column takes 8 bits of a bitboard: 6 rows plus spare
+# bits, so that shifting by 1, 7, 8 or 9 never wraps a line into the next one.
+WIDTH, HEIGHT = 7, 6
+
 
 class Connect4:
     """
     A Connect Four game.
 
-    Play moves with :meth:`play`.
+    Play moves with :meth:`play` and take them back with :meth:`undo`.
 
     Get past moves with :attr:`moves`.
 
     Check for a victory with :attr:`winner`.
 
+    The board is stored as one bitmask per player, updated in place on each
+    move, so playing and undoing moves runs in constant time. This makes the
+    same object usable for live games, replays and search.
+
     """
 
+    __slots__ = ("moves", "top", "winner", "boards")
+
     def __init__(self):
         self.moves = []
-        self.top = [0 for _ in range(7)]
+        self.top = [0 for _ in range(WIDTH)]
         self.winner = None
+        # Bitmask of checkers for PLAYER1 and PLAYER2, in this order.
+        self.boards = [0, 0]
 
     @property
     def last_player(self):
@@ -34,7 +46,22 @@ class Connect4:
         Whether the last move is winning.
 
         """
-        b = sum(1 << (8 * column + row) for _, column, row in self.moves[::-2])
+        return self._has_four(self.boards[(len(self.moves) - 1) % 2])
+
+    @property
+    def key(self):
+        """
+        Integer identifying the current position, for use in hash tables.
+
+        """
+        # Checkers of the player to move plus all occupied cells. Adding the
+        # occupied cells carries one bit above the top of each column, which
+        # keeps the sum unique for every position.
+        return self.boards[len(self.moves) % 2] + (self.boards[0] | self.boards[1])
+
+    @staticmethod
+    def _has_four(b):
+        # Vertical, diagonal, horizontal and anti-diagonal alignments.
         return any(b & b >> v & b >> 2 * v & b >> 3 * v for v in [1, 7, 8, 9])
 
     def play(self, player, column):
@@ -50,9 +77,10 @@ class Connect4:
             raise ValueError("It isn't your turn.")
 
         row = self.top[column]
-        if row == 6:
+        if row == HEIGHT:
             raise ValueError("This slot is full.")
 
+        self.boards[len(self.moves) % 2] |= 1 << (8 * column + row)
         self.moves.append((player, column, row))
         self.top[column] += 1
 
@@ -60,3 +88,27 @@ class Connect4:
             self.winner = self.last_player
 
         return row
+
+    def undo(self):
+        """
+        Take back the last move.
+
+        Returns the ``(player, column, row)`` tuple of the removed move.
+
+        Raises :exc:`ValueError` if no move was played.
+
+        """
+        if not self.moves:
+            raise ValueError("No move to undo.")
+
+        player, column, row = self.moves.pop()
+        self.top[column] -= 1
+        self.boards[len(self.moves) % 2] ^= 1 << (8 * column + row)
+
+        # Moves are undone in reverse order, so the winner's alignment
+        # disappears exactly when the move that completed it is taken back.
+        if self.winner is not None:
+            if not self._has_four(self.boards[0 if self.winner == PLAYER1 else 1]):
+                self.winner = None
+
+        return player, column, row
@@ -0,0 +1,189 @@
+"""
+Connection management shared by the servers.
+
+A :class:`ConnectionManager` caps the number of connections and the memory
+kept for each of them, closes connections that stay idle, and shuts the
+server down gracefully on SIGTERM: stop accepting connections, let queued
+messages go out within a deadline, then tell clients to go away.
+
+"""
+
+__all__ = ["ConnectionManager"]
+
+import asyncio
+import functools
+import http
+import signal
+import time
+
+from websockets.exceptions import ConnectionClosed
+
+
+class ConnectionManager:
+    """
+    Limits and lifecycle of the connections of a server.
+
+    Pass :meth:`serve_options` to ``serve()`` and wrap the handler with
+    :meth:`wrap`, then call :meth:`run` instead of waiting forever.
+
+    An ``idle_timeout`` of 0 disables idle eviction. With ``ping_idle``, an
+    idle connection is pinged first and kept if it answers: clients that
+    only read, such as chat readers, stay connected.
+
+    """
+
+    def __init__(
+        self,
+        max_connections=10_000,
+        idle_timeout=600,
+        drain_timeout=10,
+        ping_interval=20,
+        ping_timeout=20,
+        max_size=2**16,
+        max_queue=16,
+        write_limit=2**15,
+        max_buffer=2**20,
+        ping_idle=False,
+    ):
+        self.max_connections = max_connections
+        self.idle_timeout = idle_timeout
+        self.ping_idle = ping_idle
+        self.drain_timeout = drain_timeout
+        # Heartbeats: websockets pings every ping_interval seconds and closes
+        # connections that don't answer within ping_timeout, so dead peers
+        # are noticed even when the application never sends to them
+        self.ping_interval = ping_interval
+        self.ping_timeout = ping_timeout
+        # Per-connection buffers: incoming messages up to max_size bytes,
+        # max_queue of them waiting to be read; send() waits while more than
+        # write_limit bytes are waiting to be written, and connections whose
+        # unsent bytes exceed max_buffer anyway, e.g. through broadcast(),
+        # are closed
+        self.max_size = max_size
+        self.max_queue = max_queue
+        self.write_limit = write_limit
+        self.max_buffer = max_buffer
+        # Open connections: websocket -> monotonic time of last activity
+        self.connections = {}
+        # Idle connections being pinged: websocket -> task closing them
+        # unless they answer
+        self.checking = {}
+        self.closing = False
+        self.rejected = 0
+
+    def serve_options(self):
+        return {
+            "process_request": self.process_request,
+            "ping_interval": self.ping_interval,
+            "ping_timeout": self.ping_timeout,
+            "max_size": self.max_size,
+            "max_queue": self.max_queue,
+            "write_limit": self.write_limit,
+        }
+
+    def full(self):
+        return self.closing or len(self.connections) >= self.max_connections
+
+    def process_request(self, connection, request):
+        # Reject before the handshake, when it costs the least. Clients
+        # should retry with a backoff.
+        if self.full():
+            self.rejected += 1
+            return connection.respond(
+                http.HTTPStatus.SERVICE_UNAVAILABLE, "Server busy, try again later.\n"
+            )
+
+    def wrap(self, handler):
+        @functools.wraps(handler)
+        async def wrapper(websocket):
+            # Handshakes completing together may pass process_request at
+            # once; enforce the limit again, strictly
+            if self.full():
+                self.rejected += 1
+                await websocket.close(1013, "try again later")
+                return
+            self.connections[websocket] = time.monotonic()
+            try:
+                await handler(websocket)
+            finally:
+                del self.connections[websocket]
+
+        return wrapper
+
+    def touch(self, websocket):
+        # Called by the application on activity, e.g. a message received
+        if websocket in self.connections:
+            self.connections[websocket] = time.monotonic()
+
+    async def check_idle(self, websocket):
+        # A pong counts as activity: the client reads without writing
+        try:
+            pong = await websocket.ping()
+            await asyncio.wait_for(pong, self.ping_timeout)
+        except (asyncio.TimeoutError, ConnectionClosed):
+            await websocket.close(1000, "idle timeout")
+        else:
+            self.touch(websocket)
+        finally:
+            del self.checking[websocket]
+
+    async def sweep(self):
+        # One task checks every connection each second, rather than a timer
+        # per connection
+        while True:
+            await asyncio.sleep(1)
+            idle_since = time.monotonic() - self.idle_timeout
+            closing = []
+            for websocket, last_activity in self.connections.items():
+                if self.idle_timeout and last_activity < idle_since:
+                    if not self.ping_idle:
+                        closing.append(websocket.close(1000, "idle timeout"))
+                    elif websocket not in self.checking:
+                        # In the background: the sweep doesn't wait for pongs
+                        self.checking[websocket] = asyncio.create_task(self.check_idle(websocket))
+                elif websocket.transport.get_write_buffer_size() > self.max_buffer:
+                    closing.append(websocket.close(1013, "too slow to receive messages"))
+            if closing:
+                await asyncio.gather(*closing, return_exceptions=True)
+
+    async def run(self, *servers, drain=None):
+        """
+        Serve until SIGTERM or SIGINT, then shut down gracefully.
+
+        ``drain`` is an optional coroutine function returning when the
+        application has sent everything it queued for its clients.
+
+        """
+        loop = asyncio.get_running_loop()
+        stop = asyncio.Event()
+        for signum in [signal.SIGTERM, signal.SIGINT]:
+            loop.add_signal_handler(signum, stop.set)
+        sweeper = asyncio.create_task(self.sweep())
+        try:
+            await stop.wait()
+        finally:
+            sweeper.cancel()
+        await self.shutdown(servers, drain)
+
+    async def shutdown(self, servers, drain=None):
+        # Stop accepting connections; opening handshakes get HTTP 503
+        self.closing = True
+        for server in servers:
+            server.close(close_connections=False)
+        print(f"Shutting down, draining {len(self.connections)} connections")
+
+        # Let the application flush its queues, within the deadline
+        if drain is not None:
+            try:
+                await asyncio.wait_for(drain(), self.drain_timeout)
+            except asyncio.TimeoutError:
+                print(f"Drain deadline of {self.drain_timeout}s exceeded")
+
+        # Tell clients to go away; the close frame goes out after anything
+        # already written, and clients reconnect to another server
+        await asyncio.gather(
+            *[websocket.close(1001, "server shutting down") for websocket in self.connections],
+            return_exceptions=True,
+        )
+        for server in servers:
+            await server.wait_closed()
@@ -1,23 +1,79 @@
-import { createBoard, playMove } from "./connect4.js";
+import { PLAYER1, PLAYER2, createBoard, playMove } from "./connect4.js";
+
+// Subprotocol for binary events; see protocol.py for the record layouts.
+// Servers that don't support it fall back to JSON.
+const SUBPROTOCOL = "connect4.binary";
+const PLAY = 1;
+const WIN = 2;
+const HINT = 3;
+const REPLAY = 4;
+const PLAYERS = [PLAYER1, PLAYER2];
 
 window.addEventListener("DOMContentLoaded", () => {
   // Initialize the UI.
   const board = document.querySelector(".board");
   createBoard(board);
   // Open the WebSocket connection and register event handlers.
-  const websocket = new WebSocket("ws://localhost:8001/");
+  const websocket = new WebSocket("ws://localhost:8001/", [SUBPROTOCOL]);
+  websocket.binaryType = "arraybuffer";
   initGame(websocket);
   receiveMoves(board, websocket);
   sendMoves(board, websocket);
+  sendHints(websocket);
 });
 
 function showMessage(message) {
   window.setTimeout(() => window.alert(message), 50);
 }
 
+function replayMoves(board, columns) {
+  const top = [0, 0, 0, 0, 0, 0, 0];
+  columns.forEach((column, index) => {
+    const player = index % 2 ? PLAYER2 : PLAYER1;
+    playMove(board, player, column, top[column]);
+    top[column]++;
+  });
+}
+
+function decodeEvent(data) {
+  // Binary frames carry game events; text frames carry JSON.
+  if (typeof data === "string") {
+    return JSON.parse(data);
+  }
+  const bytes = new Uint8Array(data);
+  switch (bytes[0]) {
+    case PLAY:
+      return {
+        type: "play",
+        player: PLAYERS[bytes[1]],
+        column: bytes[2],
+        row: bytes[3],
+      };
+    case WIN:
+      return { type: "win", player: PLAYERS[bytes[1]] };
+    case HINT:
+      return { type: "hint", column: bytes[1] };
+    case REPLAY:
+      return { type: "replay", columns: Array.from(bytes.subarray(1)) };
+    default:
+      throw new Error(`Unsupported opcode: ${bytes[0]}.`);
+  }
+}
+
+function sendEvent(websocket, event) {
+  // Game events go as binary records when the server accepted them.
+  if (websocket.protocol === SUBPROTOCOL && event.type === "play") {
+    websocket.send(new Uint8Array([PLAY, event.column]));
+  } else if (websocket.protocol === SUBPROTOCOL && event.type === "hint") {
+    websocket.send(new Uint8Array([HINT]));
+  } else {
+    websocket.send(JSON.stringify(event));
+  }
+}
+
 function receiveMoves(board, websocket) {
   websocket.addEventListener("message", ({ data }) => {
-    const event = JSON.parse(data);
+    const event = decodeEvent(data);
     switch (event.type) {
       case "play":
         // Update the UI with the move.
@@ -28,9 +84,18 @@ function receiveMoves(board, websocket) {
         // No further messages are expected; close the WebSocket connection.
         websocket.close(1000);
         break;
+      case "hint":
+        showMessage(`Try column ${event.column + 1}.`);
+        break;
+      case "replay":
+        // Catch up with a game in progress: players alternate, starting with
+        // the first player, and checkers stack up in each column.
+        replayMoves(board, event.columns);
+        break;
       case "init":
-        // Create link for inviting the second player.
+        // Create links for inviting the second player and spectators.
         document.querySelector(".join").href = "?join=" + event.join;
+        document.querySelector(".watch").href = "?watch=" + event.watch;
         break;
       case "error":
         showMessage(event.message);
@@ -53,7 +118,15 @@ function sendMoves(board, websocket) {
       type: "play",
       column: parseInt(column, 10),
     };
-    websocket.send(JSON.stringify(event));
+    sendEvent(websocket, event);
+  });
+}
+
+function sendHints(websocket) {
+  // When clicking the hint button, ask the server for a move suggestion.
+  document.querySelector(".hint").addEventListener("click", (event) => {
+    event.preventDefault();
+    sendEvent(websocket, { type: "hint" });
   });
 }
 
@@ -65,6 +138,12 @@ function initGame(websocket) {
     if (params.has("join")) {
       // Second player joins an existing game.
       event.join = params.get("join");
+    } else if (params.has("watch")) {
+      // Spectator watches an existing game.
+      event.watch = params.get("watch");
+    } else if (params.has("computer")) {
+      // One player against the computer.
+      event.computer = true;
     } else {
       // First player starts a new game.
     }
@@ -0,0 +1,132 @@
+"""
+Wire formats for Connect Four events.
+
+Clients offering the ``connect4.binary`` subprotocol exchange game events as
+small binary records: an opcode byte followed by fixed fields. Other clients
+get JSON, as before. Rare events carrying strings, "init" and "error", are
+always JSON text frames.
+
+    play     opcode 1, player, column, row     4 bytes
+    win      opcode 2, player                  2 bytes
+    hint     opcode 3, column                  2 bytes
+    replay   opcode 4, one byte per column     1 + moves bytes
+
+Players are 0 for PLAYER1 and 1 for PLAYER2. From the client, "play" is
+opcode 1 and a column, and "hint" is opcode 3 alone. Malformed messages
+raise :exc:`ValueError`.
+
+"""
+
+__all__ = [
+    "SUBPROTOCOL",
+    "select_subprotocol",
+    "skip_compression",
+    "encode",
+    "decode",
+    "send",
+    "broadcast",
+]
+
+import json
+import struct
+
+from websockets.asyncio.server import broadcast as broadcast_message
+
+from connect4 import PLAYER1, PLAYER2, WIDTH
+
+
+SUBPROTOCOL = "connect4.binary"
+
+PLAY, WIN, HINT, REPLAY = 1, 2, 3, 4
+
+PLAYER_CODES = {PLAYER1: 0, PLAYER2: 1}
+
+CLIENT_EVENTS = {"init", "play", "hint"}
+
+RECORDS = {
+    PLAY: struct.Struct("!BBBB"),
+    WIN: struct.Struct("!BB"),
+    HINT: struct.Struct("!BB"),
+}
+
+
+def select_subprotocol(connection, subprotocols):
+    # Unlike the default, accept clients that don't offer the subprotocol:
+    # they fall back to JSON
+    return SUBPROTOCOL if SUBPROTOCOL in subprotocols else None
+
+
+def skip_compression(request):
+    # Binary records are a few bytes: compressing them costs CPU for each
+    # connection and saves nothing. Without the extensions header, clients
+    # offering the subprotocol don't negotiate permessage-deflate.
+    offered = request.headers.get("Sec-WebSocket-Protocol", "")
+    if SUBPROTOCOL in [subprotocol.strip() for subprotocol in offered.split(",")]:
+        if "Sec-WebSocket-Extensions" in request.headers:
+            del request.headers["Sec-WebSocket-Extensions"]
+
+
+def encode(event, binary):
+    """
+    Encode an event as a binary record if ``binary`` and possible, else JSON.
+
+    """
+    if binary:
+        kind = event["type"]
+        if kind == "play":
+            return RECORDS[PLAY].pack(
+                PLAY, PLAYER_CODES[event["player"]], event["column"], event["row"]
+            )
+        if kind == "win":
+            return RECORDS[WIN].pack(WIN, PLAYER_CODES[event["player"]])
+        if kind == "hint":
+            return RECORDS[HINT].pack(HINT, event["column"])
+        if kind == "replay":
+            return bytes([REPLAY, *event["columns"]])
+    return json.dumps(event)
+
+
+def decode(message):
+    """
+    Decode an event received from a client, as a binary record or JSON.
+
+    Raises :exc:`ValueError` if the message isn't a valid client event.
+
+    """
+    if isinstance(message, str):
+        # JSONDecodeError is a ValueError
+        event = json.loads(message)
+        if not isinstance(event, dict) or event.get("type") not in CLIENT_EVENTS:
+            raise ValueError("Unsupported event.")
+    elif not message:
+        raise ValueError("Empty message.")
+    elif message[0] == PLAY and len(message) == 2:
+        event = {"type": "play", "column": message[1]}
+    elif message[0] == HINT and len(message) == 1:
+        event = {"type": "hint"}
+    else:
+        raise ValueError("Unsupported event.")
+    if event["type"] == "init":
+        for key in ["join", "watch"]:
+            if key in event and not isinstance(event[key], str):
+                raise ValueError("Invalid key.")
+    if event["type"] == "play":
+        column = event.get("column")
+        # bool is an int, but not a column
+        if type(column) is not int or not 0 <= column < WIDTH:
+            raise ValueError("Invalid column.")
+    return event
+
+
+async def send(websocket, event):
+    await websocket.send(encode(event, websocket.subprotocol == SUBPROTOCOL))
+
+
+def broadcast(connections, event):
+    # Encode the event once per format, not once per connection
+    binary = [websocket for websocket in connections if websocket.subprotocol == SUBPROTOCOL]
+    text = [websocket for websocket in connections if websocket.subprotocol != SUBPROTOCOL]
+    if binary:
+        broadcast_message(binary, encode(event, True))
+    if text:
+        broadcast_message(text, encode(event, False))
@@ -1,15 +1,105 @@
+import argparse
 import asyncio
+import time
 import websockets
 
+from connections import ConnectionManager
+
+# Fast mode: echo messages unchanged, binary frames straight from the
+# receive buffer, and count them instead of printing each one.
+FAST = False
+
+# In fast mode, print one message in this many, 0 to print none.
+LOG_EVERY = 0
+
+# Seconds between throughput summaries in fast mode.
+STATS_INTERVAL = 5
+
+# Largest message accepted, in bytes; frames received but not read yet,
+# per connection; bytes buffered for sending before send() waits.
+MAX_SIZE = 2**20
+MAX_QUEUE = 16
+WRITE_LIMIT = 2**15
+
+# Connection limits, heartbeats, idle timeouts and graceful shutdown.
+manager = ConnectionManager(max_size=MAX_SIZE, max_queue=MAX_QUEUE, write_limit=WRITE_LIMIT)
+
+# Totals since the last summary, in fast mode.
+clients = 0
+messages = 0
+received_bytes = 0
+
 async def handler(websocket):
     print("Client connected")
     async for message in websocket:
+        manager.touch(websocket)
         print(f"Received message: {message}")
         await websocket.send(f"Echo: {message}")
 
+async def fast_handler(websocket):
+    global clients, messages, received_bytes
+    clients += 1
+    try:
+        # Bytes are sent back as a binary frame without being copied or
+        # decoded; text is sent back as is, without building a new string
+        async for message in websocket:
+            manager.touch(websocket)
+            await websocket.send(message)
+            messages += 1
+            received_bytes += len(message)
+            if LOG_EVERY and messages % LOG_EVERY == 0:
+                print(f"Received message #{messages}: {message[:80]!r}")
+    except websockets.exceptions.ConnectionClosedError:
+        pass
+    finally:
+        clients -= 1
+
+async def report_stats():
+    global messages, received_bytes
+    while True:
+        start = time.monotonic()
+        await asyncio.sleep(STATS_INTERVAL)
+        elapsed = time.monotonic() - start
+        print(
+            f"{clients} clients, {messages / elapsed:,.0f} msg/s, "
+            f"{received_bytes / elapsed / 1e6:,.1f} MB/s"
+        )
+        messages = received_bytes = 0
+
 async def main():
-    async with websockets.serve(handler, "localhost", 8765):
+    async with websockets.serve(
+        manager.wrap(fast_handler if FAST else handler),
+        "localhost",
+        8765,
+        **manager.serve_options(),
+    ) as server:
         print("Server started on ws://localhost:8765")
-        await asyncio.Future()  # This waits forever
+        stats_task = asyncio.create_task(report_stats()) if FAST else None
+        try:
+            # Until SIGTERM or Ctrl-C
+            await manager.run(server)
+        finally:
+            if stats_task is not None:
+                stats_task.cancel()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--fast", action="store_true",
+                        help="echo without formatting and print a summary instead of each message")
+    parser.add_argument("--log-every", type=int, default=LOG_EVERY, metavar="N",
+                        help="in fast mode, print one message in N")
+    parser.add_argument("--stats-interval", type=float, default=STATS_INTERVAL)
+    parser.add_argument("--max-size", type=int, default=MAX_SIZE)
+    parser.add_argument("--max-queue", type=int, default=MAX_QUEUE)
+    parser.add_argument("--write-limit", type=int, default=WRITE_LIMIT)
+    parser.add_argument("--max-connections", type=int, default=manager.max_connections)
+    parser.add_argument("--idle-timeout", type=float, default=manager.idle_timeout,
+                        help="seconds without messages before closing, 0 to disable")
+    args = parser.parse_args()
+    FAST, LOG_EVERY, STATS_INTERVAL = args.fast, args.log_every, args.stats_interval
+    manager = ConnectionManager(
+        args.max_connections, args.idle_timeout,
+        max_size=args.max_size, max_queue=args.max_queue, write_limit=args.write_limit,
+    )
 
-asyncio.run(main())
\ No newline at end of file
+    asyncio.run(main())
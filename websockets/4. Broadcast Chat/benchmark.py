@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+
+"""
+Compare broadcast throughput, latency and server cost across server options.
+
+    python benchmark.py [--clients 50] [--messages 5000] [--windows 0 1 5]
+    python benchmark.py --windows 0 --compressions none deflate shared --size 2000
+
+Starts server.py once per coalescing window and compression mode, connects
+receivers to the lobby and measures how fast one sender's messages reach
+all of them. Server CPU time and bytes on the loopback interface come from
+/proc (Linux).
+
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import websockets
+
+URI = "ws://localhost:8765"
+
+# Filler making messages compressible, like chat text or JSON.
+WORDS = "the quick brown fox jumps over the lazy dog "
+
+
+def usage(pid):
+    # CPU seconds used by the server so far, and bytes sent on the loopback
+    # interface, which carries all traffic between clients and server
+    with open(f"/proc/{pid}/stat") as file:
+        fields = file.read().rpartition(")")[2].split()
+    cpu = (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    with open("/proc/net/dev") as file:
+        for line in file:
+            interface, _, counters = line.partition(":")
+            if interface.strip() == "lo":
+                sent = int(counters.split()[8])
+    return cpu, sent
+
+
+async def receive(websocket, expected, latencies):
+    # Count the sender's messages and record how long each one took
+    received = 0
+    while received < expected:
+        event = json.loads(await websocket.recv())
+        events = event["events"] if event["type"] == "batch" else [event]
+        now = time.perf_counter()
+        for event in events:
+            _, _, text = event["text"].partition(": ")
+            if text.startswith("t="):
+                latencies.append(now - float(text[2:].partition(" ")[0]))
+                received += 1
+
+
+async def run(clients, messages, size, pid):
+    receivers = [await websockets.connect(URI) for _ in range(clients)]
+    sender = await websockets.connect(URI)
+    # Let join notices go through before measuring
+    await asyncio.sleep(0.5)
+    for websocket in receivers:
+        while True:
+            try:
+                await asyncio.wait_for(websocket.recv(), 0.1)
+            except asyncio.TimeoutError:
+                break
+
+    filler = (WORDS * (size // len(WORDS) + 1))[:size]
+    latencies = []
+    tasks = [asyncio.create_task(receive(ws, messages, latencies)) for ws in receivers]
+    cpu, sent = usage(pid)
+    start = time.perf_counter()
+    for _ in range(messages):
+        await sender.send(f"t={time.perf_counter()} {filler}")
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - start
+    end_cpu, end_sent = usage(pid)
+
+    for websocket in receivers + [sender]:
+        await websocket.close()
+
+    latencies.sort()
+    return {
+        "messages_per_second": len(latencies) / elapsed,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p99_ms": latencies[int(len(latencies) * 0.99)] * 1000,
+        "server_cpu_s": end_cpu - cpu,
+        "wire_mb": (end_sent - sent) / 1e6,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--messages", type=int, default=5000)
+    parser.add_argument("--windows", type=float, nargs="+", default=[0, 1, 5],
+                        help="coalescing windows to compare, in milliseconds")
+    parser.add_argument("--compressions", nargs="+", default=["deflate"],
+                        choices=["none", "deflate", "shared"])
+    parser.add_argument("--size", type=int, default=0,
+                        help="bytes of compressible text added to each message")
+    args = parser.parse_args()
+
+    print(
+        f"{'window':>8} {'compression':>12} {'msg/s':>10} {'p50 ms':>8} {'p99 ms':>8}"
+        f" {'cpu s':>7} {'wire MB':>8}"
+    )
+    for window, compression in itertools.product(args.windows, args.compressions):
+        # Queues large enough that no message is dropped during the run
+        server = subprocess.Popen(
+            [sys.executable, "server.py", "--coalesce", str(window),
+             "--compression", compression,
+             "--queue-size", str(args.messages + 100)],
+            stdout=subprocess.DEVNULL,
+        )
+        try:
+            time.sleep(1)
+            result = asyncio.run(run(args.clients, args.messages, args.size, server.pid))
+        finally:
+            server.terminate()
+            server.wait()
+        label = f"{window:g} ms" if window else "off"
+        print(
+            f"{label:>8} {compression:>12} {result['messages_per_second']:>10,.0f}"
+            f" {result['p50_ms']:>8.1f} {result['p99_ms']:>8.1f}"
+            f" {result['server_cpu_s']:>7.2f} {result['wire_mb']:>8.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+
+"""
+Measure aggregate broadcast throughput across several server processes.
+
+    python benchmark_bus.py [--nodes 1 2 4] [--clients 50] [--messages 2000]
+
+For each node count, starts broker.py and that many server.py processes
+sharing it, then connects receivers and one sender to every node from a
+separate client process per node. Every receiver gets every sender's
+messages, so the total is nodes x nodes x clients x messages deliveries.
+
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import subprocess
+import sys
+import time
+
+import websockets
+
+BROKER = "/tmp/chat-broker-benchmark.sock"
+FIRST_PORT = 8765
+
+
+async def receive(websocket, expected):
+    # Count messages sent by the benchmark, coalesced into batches or not
+    received = 0
+    while received < expected:
+        message = await websocket.recv()
+        received += message.count(": bench ")
+
+
+async def run(port, clients, messages, expected, barrier):
+    uri = f"ws://localhost:{port}"
+    receivers = [await websockets.connect(uri) for _ in range(clients)]
+    sender = await websockets.connect(uri)
+    # Let join notices from every node go through before measuring
+    await asyncio.to_thread(barrier.wait)
+    await asyncio.sleep(1)
+    for websocket in receivers:
+        while True:
+            try:
+                await asyncio.wait_for(websocket.recv(), 0.1)
+            except asyncio.TimeoutError:
+                break
+    await asyncio.to_thread(barrier.wait)
+
+    tasks = [asyncio.create_task(receive(ws, expected)) for ws in receivers]
+    start = time.perf_counter()
+    for i in range(messages):
+        await sender.send(f"bench {i}")
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - start
+
+    for websocket in receivers + [sender]:
+        await websocket.close()
+    return start, elapsed
+
+
+def client(port, clients, messages, expected, barrier, results):
+    results.put(asyncio.run(run(port, clients, messages, expected, barrier)))
+
+
+def benchmark(nodes, clients, messages):
+    broker = subprocess.Popen(
+        [sys.executable, "broker.py", "--address", BROKER],
+        stdout=subprocess.DEVNULL,
+    )
+    time.sleep(0.5)
+    # Queues large enough that no message is dropped during the run
+    servers = [
+        subprocess.Popen(
+            [sys.executable, "server.py", "--port", str(FIRST_PORT + node),
+             "--broker", BROKER, "--queue-size", str(nodes * messages + 100)],
+            stdout=subprocess.DEVNULL,
+        )
+        for node in range(nodes)
+    ]
+    try:
+        time.sleep(1.5)
+        barrier = multiprocessing.Barrier(nodes)
+        results = multiprocessing.Queue()
+        processes = [
+            multiprocessing.Process(
+                target=client,
+                args=(FIRST_PORT + node, clients, messages, nodes * messages,
+                      barrier, results),
+            )
+            for node in range(nodes)
+        ]
+        for process in processes:
+            process.start()
+        runs = [results.get() for _ in processes]
+        for process in processes:
+            process.join()
+    finally:
+        for process in servers + [broker]:
+            process.terminate()
+            process.wait()
+
+    # From the first sender starting to the last receiver finishing
+    start = min(start for start, _ in runs)
+    end = max(start + elapsed for start, elapsed in runs)
+    return nodes * nodes * clients * messages / (end - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--nodes", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--clients", type=int, default=50,
+                        help="receivers connected to each node")
+    parser.add_argument("--messages", type=int, default=2000,
+                        help="messages sent through each node")
+    args = parser.parse_args()
+
+    print(f"{'nodes':>5} {'deliveries':>12} {'msg/s':>10}")
+    for nodes in args.nodes:
+        rate = benchmark(nodes, args.clients, args.messages)
+        deliveries = nodes * nodes * args.clients * args.messages
+        print(f"{nodes:>5} {deliveries:>12,} {rate:>10,.0f}")
+
+
+if __name__ == "__main__":
+    main()
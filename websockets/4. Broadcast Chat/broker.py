@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+
+"""
+Stand-in message broker for running several Broadcast Chat servers.
+
+    python broker.py [--address /tmp/chat-broker.sock | --address localhost:8800]
+
+Nodes send one event per line. The broker numbers each event and relays it
+to every connected node, including the sender, as "<seq> <event>".
+
+"""
+
+import argparse
+import asyncio
+import os
+
+from bus import LINE_LIMIT, parse_address
+
+nodes = set()   # StreamWriters of connected nodes
+seq = 0         # sequence number of the last event relayed
+
+# Bytes waiting to be sent to a node before it's disconnected as too slow.
+MAX_BUFFER = 64 * 1024 * 1024
+
+
+async def handle(reader, writer):
+    global seq
+    nodes.add(writer)
+    print("Node connected. Total:", len(nodes))
+    try:
+        async for line in reader:
+            # Prefix the sequence number instead of parsing the event
+            seq += 1
+            line = b"%d %s" % (seq, line)
+            for node in list(nodes):
+                if node.transport.get_write_buffer_size() > MAX_BUFFER:
+                    print("Node too slow, disconnecting")
+                    nodes.discard(node)
+                    node.close()
+                else:
+                    node.write(line)
+    except ConnectionError:
+        pass
+    finally:
+        nodes.discard(writer)
+        writer.close()
+        print("Node disconnected. Total:", len(nodes))
+
+
+async def main(address):
+    host, port, path = parse_address(address)
+    if path is None:
+        server = await asyncio.start_server(handle, host, port, limit=LINE_LIMIT)
+    else:
+        if os.path.exists(path):
+            os.remove(path)
+        server = await asyncio.start_unix_server(handle, path, limit=LINE_LIMIT)
+    print(f"Broker listening on {address}")
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--address", default="/tmp/chat-broker.sock",
+                        help="host:port for TCP, or path of a Unix socket")
+    args = parser.parse_args()
+    asyncio.run(main(args.address))
@@ -0,0 +1,175 @@
+"""
+Message buses connecting Broadcast Chat servers.
+
+Every event published on a bus is delivered to every subscriber, including
+the node that published it, in the same order everywhere and stamped with
+the same sequence number. Each node then delivers events to its own sockets.
+
+"""
+
+__all__ = ["LocalBus", "BrokerBus"]
+
+import asyncio
+import collections
+import itertools
+import json
+import uuid
+
+# Event IDs remembered per bus to drop duplicates, at most.
+DEDUP_SIZE = 10_000
+
+# Seconds to wait before reconnecting to the broker.
+RECONNECT_DELAY = 1
+
+# Longest event line accepted from the broker, in bytes.
+LINE_LIMIT = 4 * 1024 * 1024
+
+# Events published while disconnected from the broker and kept for sending
+# on reconnect, at most; beyond that, the oldest are dropped.
+PENDING_SIZE = 10_000
+
+
+def parse_address(address):
+    # "host:port" for TCP, anything else is the path of a Unix socket
+    host, _, port = address.rpartition(":")
+    if host and port.isdigit():
+        return host, int(port), None
+    return None, None, address
+
+
+class Bus:
+    """
+    Base class for message buses.
+
+    Publish events with :meth:`publish`; they're dicts with an ``"id"`` key,
+    see :meth:`new_id`. Receive them with a callback registered with
+    :meth:`subscribe`, called with the sequence number and the event.
+
+    Events delivered twice, e.g. resent after a reconnect, are dropped.
+
+    """
+
+    def __init__(self):
+        self.node_id = uuid.uuid4().hex[:8]
+        self.counter = itertools.count(1)
+        self.callbacks = []
+        self.seen = collections.OrderedDict()   # recent event IDs, oldest first
+
+    def new_id(self):
+        return f"{self.node_id}-{next(self.counter)}"
+
+    def subscribe(self, callback):
+        self.callbacks.append(callback)
+
+    def receive(self, seq, event):
+        if event["id"] in self.seen:
+            return
+        self.seen[event["id"]] = None
+        if len(self.seen) > DEDUP_SIZE:
+            self.seen.popitem(last=False)
+        for callback in self.callbacks:
+            callback(seq, event)
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+    def publish(self, event):
+        raise NotImplementedError
+
+
+class LocalBus(Bus):
+    """
+    In-process bus: events are numbered and delivered immediately.
+
+    With a single subscriber, this is a single server reaching its own
+    clients. Several nodes running in one process may share it.
+
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.seq = itertools.count(1)
+
+    def publish(self, event):
+        self.receive(next(self.seq), event)
+
+
+class BrokerBus(Bus):
+    """
+    Bus going through ``broker.py``, over TCP or a Unix socket.
+
+    The broker numbers events and relays them to every connected node.
+    Events published while disconnected are kept and sent on reconnect, up
+    to ``PENDING_SIZE``. A line that's too long or malformed is a protocol
+    error: the bus drops the connection and reconnects.
+
+    """
+
+    def __init__(self, address):
+        super().__init__()
+        self.address = address
+        self.writer = None
+        self.pending = collections.deque(maxlen=PENDING_SIZE)
+        self.dropped = 0   # pending events dropped since the last reconnect
+        self.task = None
+
+    async def start(self):
+        self.task = asyncio.create_task(self.run())
+
+    async def close(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+
+    async def connect(self):
+        host, port, path = parse_address(self.address)
+        if path is None:
+            return await asyncio.open_connection(host, port, limit=LINE_LIMIT)
+        return await asyncio.open_unix_connection(path, limit=LINE_LIMIT)
+
+    async def run(self):
+        while True:
+            try:
+                reader, writer = await self.connect()
+            except OSError as exc:
+                print(f"Can't reach broker at {self.address}: {exc}")
+                await asyncio.sleep(RECONNECT_DELAY)
+                continue
+
+            self.writer = writer
+            if self.dropped:
+                print(f"Dropped {self.dropped} events published while disconnected")
+                self.dropped = 0
+            for line in self.pending:
+                writer.write(line)
+            self.pending.clear()
+
+            try:
+                # Lines are "<seq> <event as JSON>"
+                async for line in reader:
+                    seq, _, event = line.partition(b" ")
+                    self.receive(int(seq), json.loads(event))
+            except (ConnectionError, asyncio.IncompleteReadError):
+                pass
+            except ValueError as exc:
+                # A line over LINE_LIMIT or that doesn't parse: the rest of
+                # the stream can't be trusted, start over on a new connection
+                print(f"Protocol error from broker at {self.address}: {exc}")
+            finally:
+                self.writer = None
+                writer.close()
+
+            print(f"Lost connection to broker at {self.address}")
+            await asyncio.sleep(RECONNECT_DELAY)
+
+    def publish(self, event):
+        line = json.dumps(event).encode() + b"\n"
+        if self.writer is None or self.writer.is_closing():
+            if len(self.pending) == self.pending.maxlen:
+                self.dropped += 1
+            self.pending.append(line)
+        else:
+            self.writer.write(line)
@@ -1,55 +1,112 @@
 import asyncio
+import json
 import websockets
 
-async def receive_messages(websocket):
+# Seconds to wait before reconnecting after losing the connection
+RECONNECT_DELAY = 1
+
+
+def show(event, last_seen):
+    # Print one event from the server and remember the last message seen
+    # in each room, to resume from there after a reconnect
+    if event["type"] == "message":
+        last_seen[event["room"]] = max(event["seq"], last_seen.get(event["room"], 0))
+        print(f"Received: [{event['room']}] {event['text']}")
+    elif event["type"] == "history":
+        print(f"Missed in [{event['room']}]:")
+        for message in event["messages"]:
+            show(message, last_seen)
+    elif event["type"] == "batch":
+        # Several events coalesced by the server into one frame
+        for event in event["events"]:
+            show(event, last_seen)
+    elif event["type"] == "gap":
+        print(f"Some messages in [{event['room']}] are no longer available")
+    else:
+        print(f"Received: {event['text']}")
+
+
+async def receive_messages(websocket, last_seen):
     try:
         while True:
             message = await websocket.recv()
-            print(f"Received: {message}")
+            show(json.loads(message), last_seen)
     except websockets.exceptions.ConnectionClosed:
         print("Connection closed")
         return
     except Exception as e:
         print(f"Error receiving: {e}")
         return
-    
-async def send_messages(websocket):
-    # handle user input and sending
+
+
+async def read_input(lines):
+    # Read user input for the whole session, across reconnects
     while True:
         # Run input in a thread so it doesn't block the event loop
-        message = await asyncio.get_event_loop().run_in_executor(
-            None, 
-            input, 
+        line = await asyncio.get_event_loop().run_in_executor(
+            None,
+            input,
             "Enter message (or 'quit' to exit): "
         )
-        
+        await lines.put(line)
+        if line.lower() == 'quit':
+            break
+
+
+async def send_messages(websocket, lines, last_seen):
+    # handle sending
+    while True:
+        message = await lines.get()
+
         if message.lower() == 'quit':
             break
-            
+
+        # Don't resume rooms we left
+        if message.startswith("/leave "):
+            last_seen.pop(message[len("/leave "):], None)
+
         await websocket.send(message)
 
+
 async def main():
     uri = "ws://localhost:8765"
-    print(f"Connecting to {uri}...")
-    
-    try:
-        async with websockets.connect(uri) as websocket:
-            print("Connected successfully!")
-            
-            receive_task = asyncio.create_task(receive_messages(websocket))
-            
-            # Run send_messages directly (not as a task)
-            await send_messages(websocket)
-            
-            # When send completes (user quit), cancel receive
-            receive_task.cancel()
-            try:
-                await receive_task
-            except asyncio.CancelledError:
-                pass
-                
-    except Exception as e:
-        print(f"Connection error: {e}")
+    lines = asyncio.Queue()
+    last_seen = {}   # room -> last sequence number received
+    input_task = asyncio.create_task(read_input(lines))
+
+    while True:
+        print(f"Connecting to {uri}...")
+        try:
+            async with websockets.connect(uri) as websocket:
+                print("Connected successfully!")
+                print("Commands: /join <room>, /leave <room>")
+
+                # Get the messages missed while disconnected, in every room
+                for room, seq in last_seen.items():
+                    await websocket.send(f"/resume {room} {seq}")
+
+                receive_task = asyncio.create_task(receive_messages(websocket, last_seen))
+                send_task = asyncio.create_task(send_messages(websocket, lines, last_seen))
+
+                # Stop when the user quits or the connection is lost
+                done, pending = await asyncio.wait(
+                    {receive_task, send_task},
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                for task in pending:
+                    task.cancel()
+                await asyncio.gather(*pending, return_exceptions=True)
+
+                if send_task in done and send_task.exception() is None:
+                    break
+
+        except Exception as e:
+            print(f"Connection error: {e}")
+
+        await asyncio.sleep(RECONNECT_DELAY)
+
+    input_task.cancel()
+
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    asyncio.run(main())
@@ -0,0 +1,129 @@
+"""
+Token-bucket rate limiting for incoming messages.
+
+Each connection has a bucket, and so does each client IP address, shared by
+all its connections. Buckets refill lazily from the monotonic clock when
+they're used, so no timer runs per connection.
+
+"""
+
+__all__ = ["TokenBucket", "RateLimiter", "POLICIES"]
+
+import asyncio
+import collections
+import time
+
+# What to do with a message over the limit:
+# - "delay": wait until it's allowed; meanwhile the connection isn't read,
+#   so TCP flow control slows down the client
+# - "drop": discard the message
+# - "close": close the connection with code 1008 (policy violation)
+POLICIES = ["delay", "drop", "close"]
+
+
+class TokenBucket:
+    """
+    Allow ``rate`` messages per second on average, and bursts of ``burst``.
+
+    """
+
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def available(self):
+        self.refill()
+        return self.tokens >= 1
+
+    def take(self):
+        # Take a token, or return the seconds until one is available,
+        # booking it; tokens then go negative, and the next caller waits
+        # for its own token after this one
+        self.refill()
+        self.tokens -= 1
+        return max(0, -self.tokens / self.rate)
+
+    def full(self):
+        self.refill()
+        return self.tokens >= self.burst
+
+
+class RateLimiter:
+    """
+    Rate limits for every connection and every client IP address.
+
+    A rate of 0 disables the corresponding limit.
+
+    """
+
+    def __init__(self, rate, burst, ip_rate, ip_burst, policy="delay"):
+        self.rate, self.burst = rate, burst
+        self.ip_rate, self.ip_burst = ip_rate, ip_burst
+        self.policy = policy
+        self.ips = {}   # IP address -> [bucket, connections]
+        # IP addresses without connections, oldest first. Their buckets are
+        # kept until full again, so reconnecting doesn't reset the limit.
+        self.idle = collections.OrderedDict()
+        self.buckets = {}   # websocket -> bucket
+
+    def connect(self, websocket):
+        # Forget idle addresses whose buckets refilled, oldest first
+        while self.idle:
+            ip = next(iter(self.idle))
+            if not self.ips[ip][0].full():
+                break
+            del self.idle[ip]
+            del self.ips[ip]
+
+        if self.rate:
+            self.buckets[websocket] = TokenBucket(self.rate, self.burst)
+        if self.ip_rate:
+            ip = websocket.remote_address[0]
+            self.idle.pop(ip, None)
+            entry = self.ips.setdefault(ip, [TokenBucket(self.ip_rate, self.ip_burst), 0])
+            entry[1] += 1
+
+    def disconnect(self, websocket):
+        self.buckets.pop(websocket, None)
+        if self.ip_rate:
+            ip = websocket.remote_address[0]
+            entry = self.ips[ip]
+            entry[1] -= 1
+            if entry[1] == 0:
+                self.idle[ip] = None
+
+    async def allow(self, websocket):
+        """
+        Apply the limits to a message just received.
+
+        Returns whether to process it. With the "delay" policy, waits first.
+
+        """
+        buckets = [self.buckets.get(websocket)]
+        if self.ip_rate:
+            buckets.append(self.ips[websocket.remote_address[0]][0])
+        buckets = [bucket for bucket in buckets if bucket is not None]
+
+        if self.policy == "delay":
+            delay = max([bucket.take() for bucket in buckets], default=0)
+            if delay:
+                await asyncio.sleep(delay)
+            return True
+
+        # Only take tokens when every limit allows the message
+        if all(bucket.available() for bucket in buckets):
+            for bucket in buckets:
+                bucket.take()
+            return True
+        if self.policy == "close":
+            await websocket.close(1008, "rate limit exceeded")
+        return False
@@ -1,8 +1,396 @@
+import argparse
 import asyncio
+import collections
+import json
+import zlib
 import websockets
+from websockets.extensions.permessage_deflate import (
+    PerMessageDeflate,
+    ServerPerMessageDeflateFactory,
+)
+from websockets.frames import Frame, Opcode
+from websockets.protocol import State
 
-connected_clients = {}   # websocket -> user_id
+from bus import BrokerBus, LocalBus
+from connections import ConnectionManager
+from ratelimit import POLICIES, RateLimiter
+
+connected_clients = {}   # websocket -> Client
+rooms = {}               # room name -> set of Clients subscribed to it
+histories = {}           # room name -> History of recent messages
+idle_rooms = collections.OrderedDict()   # rooms without local subscribers, least recently used first
 user_counter = 0         # global counter to assign IDs
+last_seq = 0             # sequence number of the last message delivered
+
+# Bus carrying messages between servers; by default, only this one.
+bus = LocalBus()
+
+# Port for clients.
+PORT = 8765
+
+# Connection limits, heartbeats, idle timeouts and graceful shutdown.
+# Clients that only read answer pings, so they aren't idle.
+manager = ConnectionManager(ping_idle=True)
+
+# Limits on incoming messages, set with --rate-limit or --ip-rate-limit;
+# None when there are no limits.
+limiter = None
+
+# Room every client joins when connecting.
+DEFAULT_ROOM = "lobby"
+
+# Outbound messages waiting for each client, at most.
+QUEUE_SIZE = 100
+
+# What to do when a client's queue is full:
+# - "drop_oldest": discard the oldest waiting message
+# - "drop_new": discard the message being broadcast
+# - "disconnect": close the connection of the slow client
+OVERFLOW_POLICY = "drop_oldest"
+OVERFLOW_POLICIES = ["drop_oldest", "drop_new", "disconnect"]
+
+# Seconds between two reports of lagging clients.
+STATS_INTERVAL = 10
+
+# Outbound coalescing, disabled when the window is 0. After taking a message
+# from its queue, a writer waits this many seconds, then sends everything
+# that's waiting, up to a number of messages and bytes, in a single frame.
+COALESCE_WINDOW = 0
+COALESCE_MESSAGES = 100
+COALESCE_BYTES = 64 * 1024
+
+# Compression of outbound messages:
+# - "none": no compression
+# - "deflate": permessage-deflate, each message compressed for each client
+# - "shared": permessage-deflate without context takeover, so each broadcast
+#   is compressed once and the same bytes are sent to every client
+COMPRESSION = "deflate"
+COMPRESSIONS = ["none", "deflate", "shared"]
+
+# Settings for "shared" compression, matching the defaults of websockets.
+WINDOW_BITS = 12
+MEM_LEVEL = 5
+
+# With "shared" compression, shorter messages are sent uncompressed:
+# compressing them costs CPU and saves next to nothing.
+COMPRESS_MIN_SIZE = 128
+
+# Messages kept per room for clients resuming after a disconnect, at most,
+# by count and by total size in bytes.
+HISTORY_SIZE = 1000
+HISTORY_BYTES = 1 << 20
+
+# Rooms without local subscribers whose history is kept, at most, so clients
+# can resume after the last one left, or on this server after another one.
+IDLE_HISTORIES = 1000
+
+
+class History:
+    """
+    Recent messages of a room, oldest first, for resuming clients.
+
+    Messages are stored already encoded with their sequence numbers. The
+    oldest ones are evicted when the count or the byte size is exceeded.
+
+    """
+
+    def __init__(self, start):
+        self.messages = collections.deque()   # (seq, encoded message)
+        self.size = 0
+        # Messages up to this sequence number may be missing: they were
+        # evicted, or published before the room existed
+        self.evicted = start
+
+    def append(self, seq, message):
+        self.messages.append((seq, message))
+        self.size += len(message)
+        while len(self.messages) > HISTORY_SIZE or self.size > HISTORY_BYTES:
+            self.evicted, message = self.messages.popleft()
+            self.size -= len(message)
+
+    def between(self, first, last):
+        """
+        Encoded messages with ``first < seq <= last``.
+
+        Returns :obj:`None` if some of them are no longer available.
+
+        """
+        if first < self.evicted:
+            return None
+        # Walk back from the newest message: the cost is proportional to the
+        # number of messages returned, not to the size of the history
+        result = []
+        for seq, message in reversed(self.messages):
+            if seq <= first:
+                break
+            if seq <= last:
+                result.append(message)
+        result.reverse()
+        return result
+
+
+class SharedMessage:
+    """
+    A broadcast message, serialized once into a frame for all recipients.
+
+    Frames are built lazily, once per compression setting, so each message
+    is compressed at most once whatever the number of recipients.
+
+    """
+
+    def __init__(self, text):
+        self.text = text
+        self.frames = {}   # window bits, or 0 for uncompressed -> frame bytes
+
+    def frame(self, window_bits):
+        frame = self.frames.get(window_bits)
+        if frame is None:
+            data = self.text.encode()
+            if window_bits and len(data) >= COMPRESS_MIN_SIZE:
+                # Same steps as websockets: raw deflate stream, sync flush,
+                # and drop the trailing empty block 0x00 0x00 0xff 0xff
+                encoder = zlib.compressobj(wbits=-window_bits, memLevel=MEM_LEVEL)
+                data = encoder.compress(data) + encoder.flush(zlib.Z_SYNC_FLUSH)
+                frame = bytearray(Frame(Opcode.TEXT, data[:-4]).serialize(mask=False))
+                # Set RSV1 to mark the message as compressed; serialize()
+                # rejects it without the extension object
+                frame[0] |= 0x40
+                frame = bytes(frame)
+            else:
+                frame = Frame(Opcode.TEXT, data).serialize(mask=False)
+            # Server frames aren't masked, so the bytes suit every client
+            self.frames[window_bits] = frame
+        return frame
+
+
+def shared_window_bits(websocket):
+    # Compression setting of this client for shared frames: 0 if it doesn't
+    # use compression, the window bits if each message is compressed on its
+    # own, None if compressed bytes can't be shared with it
+    for extension in websocket.protocol.extensions:
+        if isinstance(extension, PerMessageDeflate):
+            if extension.local_no_context_takeover:
+                return extension.local_max_window_bits
+            return None
+    return 0
+
+
+def text_of(message):
+    return message.text if isinstance(message, SharedMessage) else message
+
+
+class Client:
+    """
+    A connected client with its own outbound queue.
+
+    Broadcasting only puts messages in the queue; a writer task per client
+    sends them, so a slow client never delays the others.
+
+    """
+
+    def __init__(self, websocket, user_id):
+        self.websocket = websocket
+        self.user_id = user_id
+        self.queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+        self.dropped = 0
+        self.sending = False   # the writer holds messages taken from the queue
+        self.closing = None
+        self.rooms = {}    # room -> seq of the last message before joining
+        self.room = None   # room receiving the client's plain messages
+        self.window_bits = shared_window_bits(websocket)
+
+    def enqueue(self, message):
+        if not self.queue.full():
+            self.queue.put_nowait(message)
+            return
+
+        # Queue full → apply the overflow policy
+        self.dropped += 1
+        if OVERFLOW_POLICY == "drop_oldest":
+            self.queue.get_nowait()
+            self.queue.put_nowait(message)
+        elif OVERFLOW_POLICY == "disconnect" and self.closing is None:
+            print(f"User {self.user_id} is too slow, disconnecting")
+            self.closing = asyncio.create_task(
+                self.websocket.close(1013, "Too slow to receive messages")
+            )
+        # "drop_new": nothing to do, the message is discarded
+
+    async def write(self):
+        try:
+            while True:
+                message = await self.queue.get()
+                self.sending = True
+                if COALESCE_WINDOW:
+                    message = await self.coalesce(message)
+                if isinstance(message, SharedMessage) and self.window_bits is not None:
+                    await self.send_shared(message)
+                else:
+                    await self.websocket.send(text_of(message))
+                self.sending = False
+        except websockets.exceptions.ConnectionClosed:
+            # The handler notices the disconnect and cleans up
+            pass
+
+    async def send_shared(self, message):
+        # Write the prebuilt frame directly: copying bytes is all that's left
+        # to do per client. Stop when the connection is closing, like send()
+        if self.websocket.state is not State.OPEN:
+            raise websockets.exceptions.ConnectionClosed(None, None)
+        self.websocket.transport.write(message.frame(self.window_bits))
+        await self.websocket.drain()
+
+    async def coalesce(self, message):
+        # Let more messages arrive, unless a full batch is already waiting
+        if self.queue.qsize() < COALESCE_MESSAGES - 1:
+            await asyncio.sleep(COALESCE_WINDOW)
+        if self.queue.empty():
+            return message
+
+        message = text_of(message)
+        batch, size = [message], len(message)
+        while (
+            not self.queue.empty()
+            and len(batch) < COALESCE_MESSAGES
+            and size < COALESCE_BYTES
+        ):
+            message = text_of(self.queue.get_nowait())
+            batch.append(message)
+            size += len(message)
+
+        # Messages are already encoded: join them without decoding
+        return f'{{"type": "batch", "events": [{", ".join(batch)}]}}'
+
+
+def publish(room, text):
+    # Go through the bus, even for local clients: it numbers messages, so
+    # every server agrees on sequence numbers
+    bus.publish({"id": bus.new_id(), "room": room, "text": text})
+
+
+def deliver(seq, event):
+    # Called by the bus for every message, from this server or another
+    global last_seq
+    room = event["room"]
+    if room not in histories:
+        histories[room] = History(last_seq)
+    last_seq = seq
+
+    # Encode the message once, for the history and all local subscribers
+    message = json.dumps({"type": "message", "room": room, "seq": seq, "text": event["text"]})
+    histories[room].append(seq, message)
+    if room not in rooms:
+        # Keep the history for resuming clients, evicting least recently used
+        set_idle(room)
+        return
+    if COMPRESSION == "shared":
+        message = SharedMessage(message)
+
+    # Only subscribers of the room get the message: O(subscribers), not
+    # O(all clients). Never awaits: each client's writer task does the sending
+    for client in rooms[room]:
+        client.enqueue(message)
+
+
+def notify(client, text):
+    # Message for this client only, not numbered nor kept in history
+    client.enqueue(json.dumps({"type": "info", "text": text}))
+
+
+def set_idle(room):
+    idle_rooms[room] = None
+    idle_rooms.move_to_end(room)
+    while len(idle_rooms) > IDLE_HISTORIES:
+        evicted, _ = idle_rooms.popitem(last=False)
+        del histories[evicted]
+
+
+def join_room(client, room):
+    if room not in rooms:
+        rooms[room] = set()
+        idle_rooms.pop(room, None)
+        if room not in histories:
+            histories[room] = History(last_seq)
+    rooms[room].add(client)
+    client.rooms[room] = last_seq
+    client.room = room
+    publish(room, f"User {client.user_id} has joined. Total: {len(rooms[room])}")
+
+
+def leave_room(client, room):
+    if room not in client.rooms:
+        return
+    del client.rooms[room]
+    subscribers = rooms[room]
+    subscribers.remove(client)
+    if not subscribers:
+        # The history stays until evicted by other idle rooms
+        del rooms[room]
+        set_idle(room)
+    if client.room == room:
+        client.room = None
+    publish(room, f"User {client.user_id} has left. Total: {len(subscribers)}")
+
+
+def resume_room(client, room, seq):
+    # A reconnecting client asks for the messages it missed after seq.
+    # Messages published after joining are delivered live, so the history
+    # only needs to cover what came before.
+    if room not in client.rooms:
+        join_room(client, room)
+    missed = histories[room].between(seq, client.rooms[room])
+
+    if missed is None:
+        # Too old: tell the client instead of sending what's left
+        client.enqueue(json.dumps({"type": "gap", "room": room}))
+    elif missed:
+        # All missed messages in one frame, reusing their encoded form
+        client.enqueue(
+            f'{{"type": "history", "room": {json.dumps(room)}, '
+            f'"messages": [{", ".join(missed)}]}}'
+        )
+
+
+def handle_message(client, message):
+    # Commands: "/join room", "/leave room" and "/resume room seq"; anything
+    # else is a message for the room joined last
+    command, _, room = message.partition(" ")
+    if command == "/join" and room:
+        join_room(client, room)
+    elif command == "/leave" and room:
+        leave_room(client, room)
+    elif command == "/resume" and room:
+        room, _, seq = room.rpartition(" ")
+        if room and seq.isdigit():
+            resume_room(client, room, int(seq))
+        else:
+            notify(client, "Usage: /resume <room> <seq>")
+    elif client.room is None:
+        notify(client, "Join a room first with: /join <room>")
+    else:
+        publish(client.room, f"User {client.user_id}: {message}")
+
+
+async def report_stats():
+    # Print clients with waiting or dropped messages, to spot who is lagging
+    while True:
+        await asyncio.sleep(STATS_INTERVAL)
+        for client in connected_clients.values():
+            depth = client.queue.qsize()
+            if depth or client.dropped:
+                print(f"User {client.user_id}: queue depth {depth}, dropped {client.dropped}")
+
+
+async def drain():
+    # On shutdown, warn clients, then wait until writers have sent what's
+    # queued; clients that disconnect meanwhile stop counting
+    for client in connected_clients.values():
+        notify(client, "Server restarting, reconnect to resume.")
+    while any(
+        client.sending or not client.queue.empty()
+        for client in connected_clients.values()
+    ):
+        await asyncio.sleep(0.01)
 
 
 async def handler(websocket):
@@ -11,70 +399,113 @@ async def handler(websocket):
     # Assign a unique ID to this client
     user_counter += 1
     user_id = user_counter
-    connected_clients[websocket] = user_id
-
-    # Notify everyone (with error handling!)
-    disconnected = []
-    for client in connected_clients:
-        try:
-            await client.send(f"User {user_id} has connected. Total: {len(connected_clients)}")
-        except:
-            disconnected.append(client)
-    
-    # Remove disconnected clients
-    for client in disconnected:
-        if client in connected_clients:
-            del connected_clients[client]
+    client = Client(websocket, user_id)
+    connected_clients[websocket] = client
+    writer_task = asyncio.create_task(client.write())
 
+    # Subscribe to the default room, which notifies its members
+    join_room(client, DEFAULT_ROOM)
     print(f"User {user_id} connected. Total:", len(connected_clients))
 
+    if limiter is not None:
+        limiter.connect(websocket)
     try:
         async for message in websocket:
-            sender_id = connected_clients[websocket]  # WHO sent it
-            
-            # Broadcast with error handling
-            disconnected = []
-            for client in connected_clients:
-                try:
-                    await client.send(f"User {sender_id}: {message}")
-                except:
-                    print(f"Failed to send to a client")
-                    disconnected.append(client)
-            
-            # Clean up disconnected clients
-            for client in disconnected:
-                if client in connected_clients:
-                    del connected_clients[client]
+            manager.touch(websocket)
+            if limiter is not None and not await limiter.allow(websocket):
+                continue
+            handle_message(client, message)
+
+    except websockets.exceptions.ConnectionClosedError:
+        # Abnormal closure, e.g. disconnected for being too slow
+        pass
 
     finally:
-        # Get ID before removal
-        if websocket in connected_clients:
-            left_user_id = connected_clients[websocket]
-            del connected_clients[websocket]
-            
-            print(f"User {left_user_id} disconnected. Total:", len(connected_clients))
-            
-            # Notify remaining clients (with error handling!)
-            disconnected = []
-            for client in connected_clients:
-                try:
-                    await client.send(
-                        f"User {left_user_id} has disconnected. Total: {len(connected_clients)}"
-                    )
-                except:
-                    disconnected.append(client)
-            
-            # Clean up any failed sends
-            for client in disconnected:
-                if client in connected_clients:
-                    del connected_clients[client]
+        del connected_clients[websocket]
+        writer_task.cancel()
+        if limiter is not None:
+            limiter.disconnect(websocket)
+
+        print(f"User {user_id} disconnected. Total:", len(connected_clients))
+
+        # Leave every room joined, notifying their remaining members:
+        # O(rooms joined), not O(all rooms)
+        for room in list(client.rooms):
+            leave_room(client, room)
+
+
+def compression_options():
+    if COMPRESSION == "none":
+        return {"compression": None}
+    if COMPRESSION == "shared":
+        # Without context takeover, each message is compressed on its own,
+        # so the same compressed bytes are valid for every client
+        extension = ServerPerMessageDeflateFactory(
+            server_no_context_takeover=True,
+            server_max_window_bits=WINDOW_BITS,
+            client_max_window_bits=WINDOW_BITS,
+            compress_settings={"memLevel": MEM_LEVEL},
+        )
+        return {"compression": None, "extensions": [extension]}
+    return {}
 
 
 async def main():
-    async with websockets.serve(handler, "localhost", 8765):
-        print("Server started on ws://localhost:8765")
-        await asyncio.Future()  # run forever
+    stats_task = asyncio.create_task(report_stats())
+    bus.subscribe(deliver)
+    await bus.start()
+    try:
+        async with websockets.serve(
+            manager.wrap(handler), "localhost", PORT,
+            **compression_options(), **manager.serve_options(),
+        ) as server:
+            print(f"Server started on ws://localhost:{PORT}")
+            # Until SIGTERM or Ctrl-C
+            await manager.run(server, drain=drain)
+    finally:
+        stats_task.cancel()
+        await bus.close()
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--broker", metavar="ADDRESS",
+                        help="share messages with other servers through broker.py "
+                             "at host:port or a Unix socket path")
+    parser.add_argument("--queue-size", type=int, default=QUEUE_SIZE)
+    parser.add_argument("--policy", choices=OVERFLOW_POLICIES, default=OVERFLOW_POLICY)
+    parser.add_argument("--coalesce", type=float, default=0, metavar="MS",
+                        help="coalescing window in milliseconds, 0 to disable")
+    parser.add_argument("--batch-messages", type=int, default=COALESCE_MESSAGES)
+    parser.add_argument("--batch-bytes", type=int, default=COALESCE_BYTES)
+    parser.add_argument("--compression", choices=COMPRESSIONS, default=COMPRESSION)
+    parser.add_argument("--rate-limit", type=float, default=0, metavar="RATE",
+                        help="messages per second per connection, 0 for no limit")
+    parser.add_argument("--burst", type=int, default=10)
+    parser.add_argument("--ip-rate-limit", type=float, default=0, metavar="RATE",
+                        help="messages per second per client IP address, 0 for no limit")
+    parser.add_argument("--ip-burst", type=int, default=50)
+    parser.add_argument("--rate-policy", choices=POLICIES, default="delay",
+                        help="what to do with messages over the limit")
+    parser.add_argument("--max-connections", type=int, default=manager.max_connections)
+    parser.add_argument("--idle-timeout", type=float, default=manager.idle_timeout,
+                        help="seconds without messages or pongs before closing, 0 to disable")
+    parser.add_argument("--drain-timeout", type=float, default=manager.drain_timeout,
+                        help="seconds to send queued messages on shutdown")
+    args = parser.parse_args()
+    manager = ConnectionManager(
+        args.max_connections, args.idle_timeout, args.drain_timeout, ping_idle=True
+    )
+    COMPRESSION = args.compression
+    PORT = args.port
+    if args.broker:
+        bus = BrokerBus(args.broker)
+    if args.rate_limit or args.ip_rate_limit:
+        limiter = RateLimiter(args.rate_limit, args.burst,
+                              args.ip_rate_limit, args.ip_burst, args.rate_policy)
+    QUEUE_SIZE, OVERFLOW_POLICY = args.queue_size, args.policy
+    COALESCE_WINDOW = args.coalesce / 1000
+    COALESCE_MESSAGES, COALESCE_BYTES = args.batch_messages, args.batch_bytes
+
+    asyncio.run(main())
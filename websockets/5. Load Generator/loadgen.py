@@ -0,0 +1,395 @@
+#!/usr/bin/env python
+
+"""
+Headless load generator for the WebSocket servers in this repository.
+
+    python loadgen.py echo --connections 1000 --messages 100
+    python loadgen.py priority --connections 1000 --window 5
+    python loadgen.py broadcast --connections 500 --senders 5 --messages 200
+    python loadgen.py connect4 --connections 1000 --messages 42
+    python loadgen.py echo --output new.json --baseline old.json
+
+Opens connections concurrently from a single process, drives scripted
+traffic through all of them and reports connections per second, messages
+per second and round-trip latency percentiles. Results can be written as
+JSON and compared with a previous run.
+
+"""
+
+import argparse
+import asyncio
+import datetime
+import json
+import random
+import re
+import resource
+import time
+
+import websockets
+
+URIS = {
+    "echo": "ws://localhost:8765",
+    "priority": "ws://localhost:8765",
+    "broadcast": "ws://localhost:8765",
+    "connect4": "ws://localhost:8001",
+}
+
+# Messages carry the time they were sent. Servers prefix them or wrap them
+# in JSON, so replies are matched by searching for the timestamp.
+TIMESTAMP = re.compile(r"t=(\d+\.\d+)")
+
+# Connect Four board size, see connect4.py.
+WIDTH, HEIGHT = 7, 6
+
+
+class Stats:
+    """
+    Measurements collected during a run.
+
+    """
+
+    def __init__(self):
+        self.connect_times = []   # seconds per successful handshake
+        self.latencies = []       # seconds per round trip or delivery
+        self.failed = 0           # connections that couldn't be opened
+        self.sent = 0
+        self.received = 0
+
+    def reply(self, sent_at):
+        self.latencies.append(time.perf_counter() - sent_at)
+        self.received += 1
+
+
+def percentiles(samples):
+    # Nearest-rank percentiles, in milliseconds
+    samples = sorted(samples)
+    if not samples:
+        return {}
+    result = {
+        f"p{p}_ms": samples[min(len(samples) - 1, len(samples) * p // 100)] * 1000
+        for p in (50, 95, 99)
+    }
+    result["max_ms"] = samples[-1] * 1000
+    return result
+
+
+async def pace(rate):
+    # Wait between messages when a rate is set; yield to other tasks anyway
+    await asyncio.sleep(1 / rate if rate else 0)
+
+
+async def open_connection(uri, stats):
+    start = time.perf_counter()
+    try:
+        websocket = await websockets.connect(uri, open_timeout=30)
+    except (OSError, asyncio.TimeoutError, websockets.exceptions.InvalidHandshake):
+        stats.failed += 1
+        return None
+    stats.connect_times.append(time.perf_counter() - start)
+    return websocket
+
+
+async def open_connections(uri, count, concurrency, stats):
+    # Limit handshakes in flight so the server's accept backlog doesn't overflow
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def limited():
+        async with semaphore:
+            return await open_connection(uri, stats)
+
+    connections = await asyncio.gather(*(limited() for _ in range(count)))
+    return [websocket for websocket in connections if websocket is not None]
+
+
+async def request_reply(websocket, args, stats, prefix=lambda i: ""):
+    # Keep up to args.window messages in flight on one connection
+    window = asyncio.Semaphore(args.window)
+
+    async def send():
+        for i in range(args.messages):
+            await window.acquire()
+            await websocket.send(f"{prefix(i)}t={time.perf_counter()!r}")
+            stats.sent += 1
+            await pace(args.rate)
+
+    async def receive():
+        received = 0
+        while received < args.messages:
+            message = await websocket.recv()
+            for sent_at in TIMESTAMP.findall(message):
+                stats.reply(float(sent_at))
+                window.release()
+                received += 1
+
+    await asyncio.gather(send(), receive())
+
+
+async def echo(connections, args, stats):
+    # Echo Chat prefixes "Echo: ", Queue-Based Echo sends messages back as is
+    await asyncio.gather(*(request_reply(ws, args, stats) for ws in connections))
+
+
+async def priority(connections, args, stats):
+    # Messages are "priority:text" with priorities cycling from 1 to 9
+    def prefix(i):
+        return f"{i % 9 + 1}:"
+
+    await asyncio.gather(*(request_reply(ws, args, stats, prefix) for ws in connections))
+
+
+async def broadcast(connections, args, stats):
+    # A few connections send, every connection receives every message
+    expected = min(args.senders, len(connections)) * args.messages
+
+    async def send(websocket):
+        for _ in range(args.messages):
+            await websocket.send(f"t={time.perf_counter()!r}")
+            stats.sent += 1
+            await pace(args.rate)
+
+    async def receive(websocket):
+        received = 0
+        while received < expected:
+            message = await websocket.recv()
+            for sent_at in TIMESTAMP.findall(message):
+                stats.reply(float(sent_at))
+                received += 1
+
+    await asyncio.gather(
+        *(receive(websocket) for websocket in connections),
+        *(send(websocket) for websocket in connections[:args.senders]),
+    )
+
+
+def wins(cells, player, column, row):
+    # Whether the checker just played at (column, row) aligns four
+    for dx, dy in [(1, 0), (0, 1), (1, 1), (1, -1)]:
+        count = 1
+        for sign in [1, -1]:
+            x, y = column + sign * dx, row + sign * dy
+            while cells.get((x, y)) == player:
+                count += 1
+                x, y = x + sign * dx, y + sign * dy
+        if count >= 4:
+            return True
+    return False
+
+
+async def connect4(connections, args, stats):
+    # Pairs of connections play two-player games with random legal moves.
+    # A win or a full board ends the game; the pair then reconnects for a
+    # new one.
+
+    async def events(websocket, queue):
+        async for message in websocket:
+            await queue.put(json.loads(message))
+
+    async def move(websocket, queue, player, column):
+        sent_at = time.perf_counter()
+        await websocket.send(json.dumps({"type": "play", "column": column}))
+        stats.sent += 1
+        # Both players receive every move; wait for this one. A "win" event
+        # from the same player isn't an ack: it follows the "play" event.
+        while True:
+            event = await queue.get()
+            if event["type"] == "error":
+                break
+            if event["type"] == "play" and event["player"] == player:
+                break
+        stats.reply(sent_at)
+
+    async def play(first, second):
+        moves = 0
+        while True:
+            await first.send(json.dumps({"type": "init"}))
+            event = json.loads(await first.recv())
+            await second.send(json.dumps({"type": "init", "join": event["join"]}))
+
+            players = [(first, asyncio.Queue(), "red"), (second, asyncio.Queue(), "yellow")]
+            readers = [asyncio.create_task(events(ws, queue)) for ws, queue, _ in players]
+            top = [0] * WIDTH
+            cells = {}
+            try:
+                for ply in range(WIDTH * HEIGHT):
+                    if moves == args.messages:
+                        return
+                    websocket, queue, player = players[ply % 2]
+                    column = random.choice([c for c in range(WIDTH) if top[c] < HEIGHT])
+                    cells[column, top[column]] = player
+                    top[column] += 1
+                    await move(websocket, queue, player, column)
+                    moves += 1
+                    if wins(cells, player, column, top[column] - 1):
+                        # The game is over: wait for the "win" event, then
+                        # start a new game with fresh queues
+                        while (await queue.get())["type"] != "win":
+                            pass
+                        break
+                    await pace(args.rate)
+            finally:
+                for reader in readers:
+                    reader.cancel()
+                await asyncio.gather(*readers, return_exceptions=True)
+                await first.close()
+                await second.close()
+
+            first = second = None
+            try:
+                first = await open_connection(args.uri, stats)
+                second = await open_connection(args.uri, stats)
+            finally:
+                # Don't leak the first connection when the second one fails,
+                # or when the scenario times out in between
+                if first is not None and second is None:
+                    await first.close()
+            if first is None or second is None:
+                return
+
+    await asyncio.gather(*(play(*pair) for pair in zip(connections[::2], connections[1::2])))
+
+
+SCENARIOS = {
+    "echo": echo,
+    "priority": priority,
+    "broadcast": broadcast,
+    "connect4": connect4,
+}
+
+
+# Arguments setting the load; runs compare only when they match.
+PARAMETERS = ("connections", "concurrency", "messages", "window", "senders", "rate")
+
+
+def parameters(args):
+    return {name: getattr(args, name) for name in PARAMETERS}
+
+
+async def run(args):
+    stats = Stats()
+    started = datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+    start = time.perf_counter()
+    connections = await open_connections(args.uri, args.connections, args.concurrency, stats)
+    connect_elapsed = time.perf_counter() - start
+
+    # Let the server settle, e.g. broadcast join notices, before measuring
+    await asyncio.sleep(args.settle)
+
+    start = time.perf_counter()
+    try:
+        await asyncio.wait_for(SCENARIOS[args.scenario](connections, args, stats), args.timeout)
+        timed_out = False
+    except asyncio.TimeoutError:
+        timed_out = True
+    elapsed = time.perf_counter() - start
+
+    await asyncio.gather(*(websocket.close() for websocket in connections))
+
+    return {
+        "scenario": args.scenario,
+        "uri": args.uri,
+        "started": started,
+        "parameters": parameters(args),
+        "connections": {
+            "opened": len(stats.connect_times),
+            "failed": stats.failed,
+            "per_second": len(connections) / connect_elapsed,
+            **percentiles(stats.connect_times),
+        },
+        "messages": {
+            "sent": stats.sent,
+            "received": stats.received,
+            "per_second": stats.received / elapsed,
+            **percentiles(stats.latencies),
+        },
+        "elapsed_s": elapsed,
+        "timed_out": timed_out,
+    }
+
+
+# Metrics compared against a baseline, and whether higher is better.
+METRICS = [
+    ("connections", "per_second", True),
+    ("messages", "per_second", True),
+    ("messages", "p50_ms", False),
+    ("messages", "p95_ms", False),
+    ("messages", "p99_ms", False),
+]
+
+
+def report(result, baseline=None):
+    connections, messages = result["connections"], result["messages"]
+    print(
+        f"{result['scenario']} on {result['uri']}: "
+        f"{connections['opened']} connections ({connections['failed']} failed), "
+        f"{messages['sent']:,} messages sent, {messages['received']:,} received"
+        f" in {result['elapsed_s']:.1f}s" + (", timed out" if result["timed_out"] else "")
+    )
+    print(f"{'metric':>24} {'value':>12}" + (f" {'baseline':>12} {'change':>8}" if baseline else ""))
+    for group, name, higher_is_better in METRICS:
+        value = result[group].get(name)
+        if value is None:
+            continue
+        line = f"{group + ' ' + name:>24} {value:>12,.2f}"
+        previous = baseline[group].get(name) if baseline else None
+        if previous:
+            change = (value - previous) / previous * 100
+            worse = change < 0 if higher_is_better else change > 0
+            line += f" {previous:>12,.2f} {change:>+7.1f}%" + (" worse" if worse else "")
+        print(line)
+
+
+def raise_open_files_limit():
+    # Each connection is a file descriptor; the default soft limit is often 1024
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("scenario", choices=SCENARIOS)
+    parser.add_argument("--uri", help="server address, defaults to the scenario's usual port")
+    parser.add_argument("--connections", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=100,
+                        help="handshakes in flight while connecting")
+    parser.add_argument("--messages", type=int, default=100,
+                        help="messages per connection, per sender or moves per game pair")
+    parser.add_argument("--window", type=int, default=1,
+                        help="messages in flight per connection for echo and priority")
+    parser.add_argument("--senders", type=int, default=1,
+                        help="connections sending in the broadcast scenario")
+    parser.add_argument("--rate", type=float, default=0,
+                        help="messages per second per sender, 0 for as fast as possible")
+    parser.add_argument("--settle", type=float, default=1,
+                        help="seconds to wait between connecting and sending")
+    parser.add_argument("--timeout", type=float, default=60,
+                        help="seconds before giving up on missing replies")
+    parser.add_argument("--output", help="write results to this JSON file")
+    parser.add_argument("--baseline", help="compare with results from this JSON file")
+    args = parser.parse_args()
+    args.uri = args.uri or URIS[args.scenario]
+
+    # Check the baseline before running: results under another load don't compare
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        expected = (baseline.get("scenario"), baseline.get("parameters"))
+        if expected != (args.scenario, parameters(args)):
+            parser.error(
+                f"{args.baseline} ran {expected[0]} with {expected[1]}, "
+                f"this run is {args.scenario} with {parameters(args)}"
+            )
+
+    raise_open_files_limit()
+    result = asyncio.run(run(args))
+    report(result, baseline)
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(result, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()